@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+router = APIRouter(prefix="/health")
+
+
+@router.get("/live", summary="Liveness probe")
+async def live() -> JSONResponse:
+    """
+    Reports that the process is up and serving requests.
+
+    Returns:
+        JSONResponse: Always status "alive".
+    """
+    return JSONResponse({"status": "alive"})
+
+
+@router.get("/ready", summary="Readiness probe")
+async def ready(request: Request) -> JSONResponse:
+    """
+    Reports whether the startup hooks completed and the service can accept extraction requests.
+
+    Returns:
+        JSONResponse: 200 with status "ready", or 503 with the startup error while not ready.
+    """
+    state = request.app.state
+    if getattr(state, "ready", False):
+        return JSONResponse({"status": "ready", "startup_seconds": state.startup_seconds})
+    return JSONResponse({"status": "starting", "error": getattr(state, "startup_error", None)}, status_code=503)
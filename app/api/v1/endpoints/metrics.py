@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.utils.metrics import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", summary="Service metrics")
+async def get_metrics() -> JSONResponse:
+    """
+    Returns:
+        JSONResponse: The current counters and gauges of the service.
+    """
+    return JSONResponse(metrics.snapshot())
@@ -0,0 +1,46 @@
+import hmac
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import JSONResponse
+from app.core.config import settings
+from app.utils.profiler import profile_store
+
+router = APIRouter(prefix="/profiles")
+
+
+def _check_access(token: Optional[str]) -> None:
+    """
+    Profiles contain source paths and timings, reading them requires the same token as creating them.
+    """
+    if not settings.profiling_enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if settings.profiling_token and not hmac.compare_digest((token or "").encode(),
+                                                            settings.profiling_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Profile-Token")
+
+
+@router.get("/", summary="List stored request profiles")
+async def list_profiles(x_profile_token: Optional[str] = Header(None)) -> JSONResponse:
+    """
+    Returns:
+        JSONResponse: The ids of the stored profiles, oldest first.
+    """
+    _check_access(x_profile_token)
+    return JSONResponse({"profile_ids": profile_store.list_ids()})
+
+
+@router.get("/{profile_id}", summary="Get a stored request profile")
+async def get_profile(profile_id: str, x_profile_token: Optional[str] = Header(None)) -> JSONResponse:
+    """
+    Args:
+        profile_id (str): The id returned in the X-Profile-Id header of the profiled request.
+        x_profile_token (str, optional): Must match PROFILING_TOKEN if it is set.
+
+    Returns:
+        JSONResponse: Stage timings and the cProfile report of the request.
+    """
+    _check_access(x_profile_token)
+    report = profile_store.get(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return JSONResponse(report)
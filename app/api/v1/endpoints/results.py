@@ -0,0 +1,50 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse
+from app.services.results_store import get_results_store
+
+router = APIRouter(prefix="/results")
+
+
+def _store():
+    store = get_results_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="The results store is disabled")
+    return store
+
+
+@router.get("/", summary="Query stored extraction results")
+def query_results(document_hash: Optional[str] = Query(None, description="Hash of the input text"),
+                  profile: Optional[str] = Query(None, description="Profile hash of examples and schema"),
+                  field: Optional[str] = Query(None, description="Indexed field, e.g. Recipe.title"),
+                  value: Optional[str] = Query(None, description="Value the field must equal"),
+                  limit: int = Query(50, ge=1, le=500),
+                  cursor: Optional[int] = Query(None, description="next_cursor of the previous page")) -> JSONResponse:
+    """
+    Returns stored results, newest first.
+
+    Returns:
+        JSONResponse: The items of the page and the next_cursor, null on the last page.
+    """
+    if (field is None) != (value is None):
+        raise HTTPException(status_code=400, detail="field and value must be given together")
+    try:
+        items, next_cursor = _store().query(document_hash, profile, field, value, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse({"items": items, "next_cursor": next_cursor})
+
+
+@router.get("/{result_id}", summary="Get a stored extraction result")
+def get_result(result_id: int) -> JSONResponse:
+    """
+    Args:
+        result_id (int): The id returned in the X-Result-Id header of the extraction.
+
+    Returns:
+        JSONResponse: The stored result with its document hash, profile and model.
+    """
+    item = _store().get(result_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail=f"Result {result_id} not found")
+    return JSONResponse(item)
@@ -1,21 +1,65 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+import asyncio
+import ipaddress
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Header, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from app.services.prompt_generator import PromptGenerator
 from app.services.completion_parser import CompletionParser
 from app.services.input_file_parser import InputFileParser
 from app.services.json_validator import JSONValidator
+from app.services.incremental_extractor import IncrementalExtractor
+from app.services.columnar_exporter import get_export_manager
+from app.services.results_store import get_results_store
+from app.services.schema_sharder import extract_sharded
+from app.services.prompt_compactor import compact_examples_for_profile
+from app.services.admission_controller import AdmissionRejected, get_admission_controller
+from app.services.api_key_pool import NoKeyAvailable
+from app.services.output_budget import OutputBudget, OutputTimeout, OutputTruncated, get_output_estimator
+from app.services.traffic_capture import get_traffic_capture
+from app.utils.cancellation import CancellationToken, RequestCancelled
+from app.utils.hashing import content_hash, profile_hash
 from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+from app.utils.profiler import get_request_profiler, profile_store
 from app.services.gpt_service import GPTService
 from app.core.config import settings
 
 router = APIRouter()
 
+DUPLICATE_MODES = ("off", "reuse", "flag")
+
+
+@dataclass
+class PipelineOptions:
+    """
+    Per-request options of the extraction pipeline.
+    """
+    incremental_document_id: Optional[str] = None
+    duplicate_mode: str = "off"
+    sharded: bool = False
+    cancellation: CancellationToken = field(default_factory=CancellationToken)
+    # Capture record of the request, filled by the pipeline when traffic capture is enabled
+    capture: Optional[Dict[str, Any]] = None
+
 
 @router.post("/", summary="Convert unstructured text documents into structured JSON")
-async def process_unstructured_text(examples_file: UploadFile = File(..., media_type="text/plain"),
+async def process_unstructured_text(request: Request,
+                                    examples_file: UploadFile = File(..., media_type="text/plain"),
                                     text_file:     UploadFile = File(..., media_type="text/plain"),
                                     json_file:     UploadFile = File(..., media_type="application/json"),
-                                    validation_schema_file:  UploadFile = File(..., media_type="application/json")) -> JSONResponse:
+                                    validation_schema_file:  UploadFile = File(..., media_type="application/json"),
+                                    document_id: Optional[str] = Form(None),
+                                    incremental: bool = Form(False),
+                                    duplicate_mode: Optional[str] = Form(None),
+                                    sharded: Optional[bool] = Form(None),
+                                    profile: Optional[str] = Query(None, description="Set to true to profile this request"),
+                                    x_profile: Optional[str] = Header(None),
+                                    x_profile_token: Optional[str] = Header(None),
+                                    x_client_id: Optional[str] = Header(None),
+                                    x_request_deadline: Optional[str] = Header(None)) -> JSONResponse:
     """
     Processes unstructured text input and validates the output JSON against the user-provided schema.
 
@@ -23,44 +67,327 @@ async def process_unstructured_text(examples_file: UploadFile = File(..., media_
         examples_file (UploadFile): File path containing examples of the structured JSON output.
         text_file (UploadFile): File path containing unstructured text.
         json_file (UploadFile): File path for the response schema structure.
+        document_id (str): Caller-chosen id of the document, required for incremental extraction.
+        incremental (bool): Re-extract only the sections that changed since the last submission of the document.
+        duplicate_mode (str): "reuse" returns the stored result of a near-duplicate text, "flag" rejects the
+            request with 409 and names the near-duplicate, "off" always extracts. Defaults to DEDUP_MODE.
+        sharded (bool): Extract the top-level schema properties in concurrent shards. Defaults to SHARDED_EXTRACTION.
+        profile (str): Query flag to request a profile of this request, same as the X-Profile header.
+        x_client_id (str): Identifies the caller for per-client quotas, only honored from ADMISSION_TRUSTED_PROXIES.
+            Other callers are identified by their address.
+        x_request_deadline (str): Seconds the caller waits for the result, or an absolute Unix timestamp.
+            The request and its in-flight LLM calls are cancelled when it passes or the client disconnects.
     Returns: 
         JSONResponse: Structured Text
     """
 
+    if incremental and not document_id:
+        raise HTTPException(status_code=400, detail="Incremental extraction requires a document_id")
+    duplicate_mode = duplicate_mode or settings.dedup_mode
+    if duplicate_mode not in DUPLICATE_MODES:
+        raise HTTPException(status_code=400, detail=f"duplicate_mode must be one of {', '.join(DUPLICATE_MODES)}")
+
+    cancellation = CancellationToken(_parse_deadline(x_request_deadline))
+    options = PipelineOptions(incremental_document_id=document_id if incremental else None,
+                              duplicate_mode=duplicate_mode,
+                              sharded=settings.sharded_extraction if sharded is None else sharded,
+                              cancellation=cancellation)
+    capture = get_traffic_capture()
+    if capture:
+        options.capture = capture.new_record()
+        options.capture["sizes"] = {"examples": examples_file.size, "text": text_file.size, "json": json_file.size,
+                                    "validation": validation_schema_file.size}
+        options.capture["options"] = {"incremental": incremental, "sharded": options.sharded,
+                                      "duplicate_mode": duplicate_mode, "deadline": cancellation.remaining()}
+        # Completed with the status and latency and written by the capture middleware
+        request.state.capture = options.capture
+    profiler = get_request_profiler(x_profile or profile, x_profile_token)
+    client_id = _client_id(request, x_client_id) if settings.admission_client_max_in_flight else None
+    watcher = asyncio.create_task(_watch_request(request, cancellation))
+    try:
+        # Queued requests are ordered by their expected generation time when shortest-job-first is configured
+        expected_seconds = get_output_estimator().expected_seconds(text_file.size)
+        async with get_admission_controller().admit(client_id, cancellation.remaining(), expected_seconds):
+            # The pipeline blocks on file parsing and the OpenAI call, run it off the event loop
+            response = await run_in_threadpool(_run_profiled, profiler, examples_file, text_file, json_file,
+                                               validation_schema_file, options)
+    except AdmissionRejected as e:
+        cancellation.check_deadline()
+        if not cancellation.cancelled:
+            raise HTTPException(status_code=e.status_code, detail=f"Service saturated: {e.reason}",
+                                headers={"Retry-After": str(e.retry_after)})
+        raise _cancelled_exception(RequestCancelled(cancellation.reason))
+    except RequestCancelled as e:
+        raise _cancelled_exception(e)
+    except HTTPException as e:
+        if profiler.enabled:
+            profile_store.save(profiler)
+            e.headers = {**(e.headers or {}), **_profile_headers(profiler)}
+        raise
+    finally:
+        watcher.cancel()
+
+    if profiler.enabled:
+        profile_store.save(profiler)
+        response.headers.update(_profile_headers(profiler))
+    return response
+
+
+def _parse_deadline(value: Optional[str]) -> Optional[float]:
+    """
+    Converts the X-Request-Deadline header, relative seconds or an absolute Unix timestamp, into a
+    time.monotonic() deadline. Falls back to REQUEST_DEADLINE_SECONDS.
+    """
+    seconds = settings.request_deadline_seconds or None
+    if value:
+        try:
+            seconds = float(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Deadline must be seconds or a Unix timestamp")
+        # Values this large are absolute timestamps rather than durations
+        if seconds > 1e9:
+            seconds -= time.time()
+    return time.monotonic() + seconds if seconds is not None else None
+
+
+def _client_id(request: Request, x_client_id: Optional[str]) -> Optional[str]:
+    """
+    Identifies the caller for per-client quotas by its peer address. The X-Client-Id header is chosen by
+    the caller, so it is only trusted from the proxies listed in ADMISSION_TRUSTED_PROXIES.
+    """
+    peer = request.client.host if request.client else None
+    if x_client_id and peer and _is_trusted_proxy(peer):
+        return x_client_id
+    return peer
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        peer = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    for entry in settings.admission_trusted_proxies.split(","):
+        try:
+            if entry.strip() and peer in ipaddress.ip_network(entry.strip(), strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+async def _watch_request(request: Request, cancellation: CancellationToken) -> None:
+    """
+    Cancels the request when the client disconnects or the deadline passes.
+    """
+    while not cancellation.cancelled:
+        cancellation.check_deadline()
+        if await request.is_disconnected():
+            cancellation.cancel("client_disconnected")
+        await asyncio.sleep(settings.disconnect_poll_interval)
+
+
+def _cancelled_exception(error: RequestCancelled) -> HTTPException:
+    """
+    Counts the cancellation and maps it to 504 for a passed deadline, 499 for a disconnected client.
+    """
+    metrics.increment("requests_cancelled_total", reason=error.reason)
+    status_code = 504 if error.reason == "deadline_exceeded" else 499
+    return HTTPException(status_code=status_code, detail=str(error))
+
+
+def _run_profiled(profiler, *args) -> JSONResponse:
+    """
+    Runs the pipeline with the profiler active in the calling worker thread.
+    """
+    profiler.start()
+    try:
+        return _run_pipeline(profiler, *args)
+    finally:
+        profiler.stop()
+
+
+def _profile_headers(profiler) -> dict:
+    """
+    Headers pointing the caller to the stored profile of the request.
+    """
+    return {"X-Profile-Id": profiler.profile_id, "Server-Timing": profiler.server_timing()}
+
+
+def _read_upload(upload: UploadFile) -> bytes:
+    """
+    Reads an already parsed upload again from the start.
+    """
+    upload.file.seek(0)
+    return upload.file.read()
+
+
+def _output_budget(text: str, response_format: Dict[str, Any], prompt: List[dict]) -> Optional[OutputBudget]:
+    """
+    Estimates the output of a completion to limit its tokens and time, unless output budgets are disabled.
+    """
+    if not settings.output_budget_enabled:
+        return None
+    return get_output_estimator().estimate(text, response_format, prompt)
+
+
+def _complete(gpt_service: GPTService, text: str, examples: str, compact: bool, response_format: Dict[str, Any],
+              cancellation: CancellationToken, prefix_profile: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Extracts a text with one LLM request and parses the completion.
+    """
+    cancellation.raise_if_cancelled()
+    prompt_generator = PromptGenerator(text, examples, compact, prefix_profile)
+    prompt = prompt_generator.generate_prompt()
+    completion = gpt_service.complete_prompt(prompt, response_format, cancellation=cancellation,
+                                             budget=_output_budget(text, response_format, prompt),
+                                             cache_key=prompt_generator.cache_key)
+    return CompletionParser(completion).parse_completion()
+
+
+def _run_pipeline(profiler, examples_file: UploadFile, text_file: UploadFile, json_file: UploadFile,
+                  validation_schema_file: UploadFile, options: PipelineOptions) -> JSONResponse:
+    """
+    Runs the extraction pipeline, measuring each stage with the given profiler.
+    With an incremental_document_id, only the changed sections of the document are sent to the LLM.
+    Unless duplicate_mode is "off", near-duplicates of already extracted texts are answered from the duplicate index.
+    With sharded, the top-level properties of the schema are extracted concurrently.
+    """
+    cancellation = options.cancellation
     try:
         logger = get_logger("Unstructured Text Processing")
         # Parse uploaded file
         logger.info("Parsing uploaded files")
-        file_parser = InputFileParser()
-        examples = file_parser.parse_examples(examples_file.file)
-        output_schema = file_parser.parse_json(json_file.file)
-        unstructured_text = file_parser.parse_text(text_file.file)
-        validation_schema = file_parser.parse_validation_schema(validation_schema_file.file)
-
-        # Generate a prompt
-        logger.info("Generating prompt for LLM API.")
-        prompt_generator = PromptGenerator(unstructured_text, examples)
-        prompt = prompt_generator.generate_prompt()
-
-        # Create OpenAI instance and make a request
-        logger.info("Making a request to OpenAI")
+        with profiler.stage("parse_files"):
+            file_parser = InputFileParser()
+            examples = file_parser.parse_examples(examples_file.file)
+            output_schema = file_parser.parse_json(json_file.file)
+            unstructured_text = file_parser.parse_text(text_file.file)
+            validation_schema = file_parser.parse_validation_schema(validation_schema_file.file)
+            # Hash of the uploaded bytes, the parsed text is the str() of the bytes
+            document_hash = content_hash(_read_upload(text_file))
+
+        profile = profile_hash(examples, output_schema)
+        headers = {}
+        if options.capture is not None:
+            options.capture["profile"] = profile
+            get_traffic_capture().add_profile(profile, *(_read_upload(upload) for upload in
+                                                         (examples_file, json_file, validation_schema_file)))
+        compact = settings.prompt_compaction
+        if compact:
+            with profiler.stage("compact_prompt"):
+                examples, tokens_saved = compact_examples_for_profile(profile, examples)
+            headers["X-Prompt-Tokens-Saved"] = str(tokens_saved)
+
+        duplicate_index = None
+        if options.duplicate_mode != "off":
+            # Imported lazily, numpy is only needed when duplicate detection is used
+            from app.services.duplicate_detector import get_duplicate_index
+
+            with profiler.stage("duplicate_lookup"):
+                duplicate_index = get_duplicate_index()
+                match = duplicate_index.find(unstructured_text, profile)
+            if match:
+                entry, similarity = match
+                duplicate_headers = {"X-Duplicate-Of": entry["id"], "X-Duplicate-Similarity": f"{similarity:.3f}"}
+                logger.info(f"Text is a near-duplicate of {entry['id']} (similarity {similarity:.3f})")
+                if options.duplicate_mode == "flag":
+                    raise HTTPException(status_code=409, headers=duplicate_headers,
+                                        detail={"message": "Text is a near-duplicate of an extracted document",
+                                                "duplicate_of": entry["id"], "similarity": round(similarity, 3)})
+                return JSONResponse(entry["result"], headers=duplicate_headers)
+
         gpt_service = GPTService(api_key=settings.llm_api_key)
-        gpt_response = gpt_service.complete_prompt(prompt, output_schema)
+        if options.capture is not None:
+            gpt_service.captured = options.capture["completions"]
+        # The system prompt and examples are sent as the byte-stable prefix of the profile
+        prefix_profile = profile if settings.prompt_prefix_cache else None
+
+        def extract(text: str) -> Optional[Dict[str, Any]]:
+            if options.sharded:
+                return extract_sharded(lambda shard_format, shard_cancellation: _complete(
+                    gpt_service, text, examples, compact, shard_format, shard_cancellation, prefix_profile),
+                    output_schema, settings.shard_max_shards, cancellation)
+            return _complete(gpt_service, text, examples, compact, output_schema, cancellation, prefix_profile)
+
+        extractor = None
+        if options.incremental_document_id:
+            logger.info("Extracting changed sections of the document")
+            with profiler.stage("incremental_extract"):
+                extractor = IncrementalExtractor(extract, output_schema, profile)
+                parsed_response = extractor.extract(options.incremental_document_id, unstructured_text)
+                headers["X-Sections-Reused"] = str(extractor.reused_sections)
+                headers["X-Sections-Extracted"] = str(extractor.extracted_sections)
+        elif options.sharded:
+            logger.info("Extracting schema shards concurrently")
+            with profiler.stage("sharded_extract"):
+                parsed_response = extract(unstructured_text)
+        else:
+            # Generate a prompt
+            logger.info("Generating prompt for LLM API.")
+            with profiler.stage("generate_prompt"):
+                prompt_generator = PromptGenerator(unstructured_text, examples, compact, prefix_profile)
+                prompt = prompt_generator.generate_prompt()
+
+            # Create OpenAI instance and make a request
+            logger.info("Making a request to OpenAI")
+            with profiler.stage("complete_prompt"):
+                gpt_response = gpt_service.complete_prompt(prompt, output_schema, cancellation=cancellation,
+                                                           budget=_output_budget(unstructured_text, output_schema,
+                                                                                 prompt),
+                                                           cache_key=prompt_generator.cache_key)
+
+            # Parse the response
+            logger.info("Parsing LLM completion response")
+            with profiler.stage("parse_completion"):
+                completion_parser = CompletionParser(gpt_response)
+                parsed_response = completion_parser.parse_completion()
 
-        # Parse the response
-        logger.info("Parsing LLM completion response")
-        completion_parser = CompletionParser(gpt_response)
-        parsed_response = completion_parser.parse_completion()
+        cancellation.raise_if_cancelled()
+        if gpt_service.usage_totals:
+            headers["X-Prompt-Tokens"] = str(gpt_service.usage_totals["prompt_tokens"])
+            headers["X-Cached-Tokens"] = str(gpt_service.usage_totals["cached_tokens"])
 
         # Validate
         logger.info("Validating JSON structure")
-        validator = JSONValidator(parsed_response, validation_schema)
-        try:
-            validator.validate_structure()
-            return JSONResponse(parsed_response)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Validation failed{str(e)}")
+        with profiler.stage("validate"):
+            validator = JSONValidator(parsed_response, validation_schema)
+            try:
+                validator.validate_structure()
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Validation failed{str(e)}")
+
+        if extractor:
+            extractor.save()
+
+        if duplicate_index:
+            headers["X-Document-Hash"] = duplicate_index.add(unstructured_text, profile, parsed_response)
+
+        headers["X-Text-Hash"] = document_hash
+        results_store = get_results_store()
+        if results_store:
+            with profiler.stage("store_result"):
+                result_id = results_store.add(document_hash, profile, GPTService.DEFAULT_MODEL, parsed_response)
+            headers["X-Result-Id"] = str(result_id)
 
+        export_manager = get_export_manager()
+        if export_manager:
+            with profiler.stage("export"):
+                export_manager.add(profile, output_schema, parsed_response, document_hash)
+        return JSONResponse(parsed_response, headers=headers)
+
+    except (HTTPException, RequestCancelled):
+        raise
+    except NoKeyAvailable as e:
+        logger.error(f"Error processing the unstructured text: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(max(1, round(settings.llm_key_wait_timeout)))})
+    except OutputTruncated as e:
+        # The output limit is chosen by the service, the input is not at fault
+        logger.error(f"Error processing the unstructured text: {str(e)}")
+        raise HTTPException(status_code=502, detail=str(e))
+    except OutputTimeout as e:
+        logger.error(f"Error processing the unstructured text: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing the unstructured text: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,8 +1,8 @@
+from functools import lru_cache
+from typing import Any
+
 from pydantic import Field
 from pydantic_settings import BaseSettings
-from dotenv import load_dotenv
-
-load_dotenv()
 
 
 class Settings(BaseSettings):
@@ -16,7 +16,12 @@ class Settings(BaseSettings):
     app_version: str = Field("1.0.0", env="")
 
     # LLM API Settings
-    llm_api_key: str = Field(..., env="LLM_API_KEY", description="LLM API Key for accessing the LLM service")
+    llm_api_key: str = Field("", env="LLM_API_KEY", description="LLM API Key for accessing the LLM service")
+    llm_api_keys: str = Field("", env="LLM_API_KEYS",
+                              description="Comma-separated key pool as key or key:organization, overrides LLM_API_KEY")
+    llm_api_keys_file: str = Field("", env="LLM_API_KEYS_FILE",
+                                   description="File with the key pool entries, overrides LLM_API_KEYS and is "
+                                               "reloaded when it changes")
 
     # Logging settings
     log_level: str = Field("DEBUG", env="LOG_LEVEL", description="Logging level")
@@ -26,5 +31,143 @@ class Settings(BaseSettings):
 
     examples_separator: str = Field("===", env="EXAMPLES_SEPARATOR", description="Separator for examples in the prompt")
 
+    # Startup settings
+    warm_up_on_startup: bool = Field(True, env="WARM_UP_ON_STARTUP",
+                                     description="Create shared clients and import heavy modules during startup")
+
+    # Profiling settings
+    profiling_enabled: bool = Field(False, env="PROFILING_ENABLED",
+                                    description="Allow callers to request a profile of individual requests")
+    profiling_token: str = Field("", env="PROFILING_TOKEN",
+                                 description="If set, profiled requests must send it in the X-Profile-Token header")
+    profile_store_size: int = Field(50, env="PROFILE_STORE_SIZE", description="Number of profiles kept in memory")
+
+    # Incremental extraction settings
+    incremental_store_dir: str = Field("data/incremental", env="INCREMENTAL_STORE_DIR",
+                                       description="Directory for per-document section hashes and partial results")
+    incremental_section_chars: int = Field(400, env="INCREMENTAL_SECTION_CHARS",
+                                           description="Average section size in chars, sections end at paragraphs "
+                                                       "chosen by their content hash")
+
+    # Near-duplicate detection settings
+    dedup_mode: str = Field("off", env="DEDUP_MODE",
+                            description="Default handling of near-duplicate texts: off, reuse or flag")
+    dedup_store_dir: str = Field("data/dedup", env="DEDUP_STORE_DIR", description="Directory of the duplicate index")
+    dedup_threshold: float = Field(0.9, env="DEDUP_THRESHOLD",
+                                   description="Minimum estimated Jaccard similarity of a near-duplicate")
+    dedup_num_perm: int = Field(128, env="DEDUP_NUM_PERM", description="MinHash signature length")
+    dedup_bands: int = Field(32, env="DEDUP_BANDS", description="Number of LSH bands, must divide DEDUP_NUM_PERM")
+    dedup_shingle_size: int = Field(5, env="DEDUP_SHINGLE_SIZE", description="Characters per shingle")
+
+    # Columnar export settings
+    export_dir: str = Field("", env="EXPORT_DIR",
+                            description="If set, validated results are exported to columnar tables in this directory")
+    export_format: str = Field("parquet", env="EXPORT_FORMAT", description="Export file format: parquet or arrow")
+    export_row_group_size: int = Field(1000, env="EXPORT_ROW_GROUP_SIZE",
+                                       description="Rows buffered per table before a row group is written")
+    export_records_per_file: int = Field(100000, env="EXPORT_RECORDS_PER_FILE",
+                                         description="Results per export part before its files are finalized")
+
+    # Prompt compaction settings
+    prompt_compaction: bool = Field(False, env="PROMPT_COMPACTION",
+                                    description="Minify the examples and use the short system prompt")
+    compaction_drop_nulls: bool = Field(True, env="COMPACTION_DROP_NULLS",
+                                        description="Drop null fields from compacted example outputs")
+    prompt_prefix_cache: bool = Field(True, env="PROMPT_PREFIX_CACHE",
+                                      description="Send a byte-stable, canonical prompt prefix per profile")
+
+    # Cancellation settings
+    request_deadline_seconds: float = Field(0, env="REQUEST_DEADLINE_SECONDS",
+                                            description="Default deadline of a request without X-Request-Deadline, "
+                                                        "0 disables")
+    disconnect_poll_interval: float = Field(0.25, env="DISCONNECT_POLL_INTERVAL",
+                                            description="Seconds between checks for client disconnects and deadlines")
+
+    # Sharded extraction settings
+    sharded_extraction: bool = Field(False, env="SHARDED_EXTRACTION",
+                                     description="Extract the top-level schema properties in concurrent shards")
+    shard_max_shards: int = Field(4, env="SHARD_MAX_SHARDS", description="Maximum number of concurrent shards")
+
+    # Results store settings
+    results_db_path: str = Field("data/results.sqlite", env="RESULTS_DB_PATH",
+                                 description="SQLite file storing validated results, empty disables the store")
+    results_index_fields: str = Field("", env="RESULTS_INDEX_FIELDS",
+                                      description="Comma-separated JSON paths of extracted fields to index")
+
+    # Admission control settings
+    admission_max_in_flight: int = Field(8, env="ADMISSION_MAX_IN_FLIGHT",
+                                         description="Maximum number of concurrently running extractions")
+    admission_max_queue: int = Field(32, env="ADMISSION_MAX_QUEUE",
+                                     description="Maximum number of requests waiting for an extraction slot")
+    admission_queue_timeout: float = Field(10.0, env="ADMISSION_QUEUE_TIMEOUT",
+                                           description="Seconds a request may wait for an extraction slot")
+    admission_client_max_in_flight: int = Field(0, env="ADMISSION_CLIENT_MAX_IN_FLIGHT",
+                                                description="Running plus queued requests per client, 0 disables")
+    admission_trusted_proxies: str = Field("", env="ADMISSION_TRUSTED_PROXIES",
+                                           description="Comma-separated addresses or networks of proxies whose "
+                                                       "X-Client-Id header identifies the client")
+    admission_scheduling: str = Field("fifo", env="ADMISSION_SCHEDULING",
+                                      description="Order of queued requests: fifo or sjf (shortest expected job first)")
+
+    # Output budget settings
+    output_budget_enabled: bool = Field(True, env="OUTPUT_BUDGET_ENABLED",
+                                        description="Send max_tokens and a timeout derived from the expected output")
+    output_tokens_per_input_token: float = Field(1.0, env="OUTPUT_TOKENS_PER_INPUT_TOKEN",
+                                                 description="Completion tokens expected per token of input text")
+    output_budget_headroom: float = Field(2.0, env="OUTPUT_BUDGET_HEADROOM",
+                                          description="Factor between the expected output tokens and max_tokens")
+    output_budget_min_tokens: int = Field(256, env="OUTPUT_BUDGET_MIN_TOKENS", description="Lower bound of max_tokens")
+    output_budget_max_tokens: int = Field(16384, env="OUTPUT_BUDGET_MAX_TOKENS",
+                                          description="Upper bound of max_tokens, the output limit of the model")
+    output_timeout_base: float = Field(10.0, env="OUTPUT_TIMEOUT_BASE",
+                                       description="Seconds of the request timeout besides the generation")
+    output_tokens_per_second: float = Field(40.0, env="OUTPUT_TOKENS_PER_SECOND",
+                                            description="Assumed generation speed used to derive the request timeout")
+    llm_input_cost_per_million: float = Field(2.5, env="LLM_INPUT_COST_PER_MILLION",
+                                              description="Price of one million prompt tokens")
+    llm_output_cost_per_million: float = Field(10.0, env="LLM_OUTPUT_COST_PER_MILLION",
+                                               description="Price of one million completion tokens")
+
+    # API key pool settings
+    llm_key_requests_per_minute: int = Field(0, env="LLM_KEY_REQUESTS_PER_MINUTE",
+                                             description="Request budget of each API key per minute, 0 for no budget")
+    llm_key_tokens_per_minute: int = Field(0, env="LLM_KEY_TOKENS_PER_MINUTE",
+                                           description="Token budget of each API key per minute, 0 for no budget")
+    llm_key_eviction_seconds: float = Field(60.0, env="LLM_KEY_EVICTION_SECONDS",
+                                            description="Seconds a key failing with an auth or quota error is skipped")
+    llm_key_wait_timeout: float = Field(30.0, env="LLM_KEY_WAIT_TIMEOUT",
+                                        description="Seconds a request may wait for a key with enough budget")
+
+    # Traffic capture settings
+    capture_path: str = Field("", env="CAPTURE_PATH",
+                              description="JSONL file recording anonymized request metadata, empty disables capture")
+    capture_mask_values: bool = Field(True, env="CAPTURE_MASK_VALUES",
+                                      description="Mask the string values of captured completions and record "
+                                                  "the profile files as hashes")
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Loads the .env file and builds the settings on first use.
+
+    Returns:
+        Settings: The cached application settings.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return Settings()
+
+
+class _LazySettings:
+    """
+    Proxy that defers loading the settings until an attribute is first accessed,
+    so importing this module does not read the environment or require LLM_API_KEY.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_settings(), name)
+
 
-settings = Settings()
+settings = _LazySettings()
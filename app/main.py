@@ -1,10 +1,85 @@
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from app.api.v1.endpoints.text_structuring import router as recipe_router
+from app.api.v1.endpoints.health import router as health_router
+from app.api.v1.endpoints.profiles import router as profiles_router
+from app.api.v1.endpoints.metrics import router as metrics_router
+from app.api.v1.endpoints.results import router as results_router
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup and shutdown hooks. Loads the settings, creates the shared clients once and
+    imports the heavy modules so the first request does not pay for them.
+    """
+    from app.core.config import get_settings
+    from app.services.admission_controller import get_admission_controller
+    from app.services.columnar_exporter import close_export_manager
+    from app.services.gpt_service import GPTService
+    from app.services.json_validator import JSONValidator
+    from app.services.results_store import close_results_store
+    from app.utils import tokens
+    from app.utils.logger import get_logger
+
+    started = time.perf_counter()
+    app.state.ready = False
+    app.state.startup_error = None
+    try:
+        settings = get_settings()
+        logger = get_logger("Lifespan")
+        get_admission_controller()
+        if settings.warm_up_on_startup:
+            logger.info("Warming up shared clients")
+            GPTService.warm_up(settings.llm_api_key)
+            JSONValidator.warm_up()
+            tokens.warm_up()
+        app.state.startup_seconds = round(time.perf_counter() - started, 4)
+        app.state.ready = True
+        logger.info(f"Startup completed in {app.state.startup_seconds}s")
+    except Exception as e:
+        # Keep serving so the readiness probe can report the failure instead of crash-looping
+        app.state.startup_error = str(e)
+
+    yield
+
+    app.state.ready = False
+    GPTService.close_client()
+    close_export_manager()
+    close_results_store()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(recipe_router)
+app.include_router(health_router)
+app.include_router(profiles_router)
+app.include_router(metrics_router)
+app.include_router(results_router)
+
+
+def _capture_enabled() -> bool:
+    """
+    Whether traffic capture is configured. Middleware cannot be added once the app serves requests, so this
+    reads the settings at import.
+    """
+    from app.core.config import get_settings
+
+    try:
+        return bool(get_settings().capture_path)
+    except Exception:
+        # Invalid settings are reported by the readiness probe after startup
+        return False
+
+
+if _capture_enabled():
+    from app.services.traffic_capture import TrafficCaptureMiddleware
+
+    app.add_middleware(TrafficCaptureMiddleware)
+
 
 app.add_middleware(
     CORSMiddleware,
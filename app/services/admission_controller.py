@@ -0,0 +1,181 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.core.config import settings
+from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is shed instead of queued.
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits the number of in-flight extractions. Requests beyond the limit wait in a bounded queue
+    for at most `queue_timeout` seconds; when the queue is full or the wait times out the request is
+    rejected right away with 503, and a client over its own quota with 429.
+
+    Queued requests are admitted in arrival order, or with "sjf" scheduling the one with the shortest
+    expected job first, which lowers the mean latency. Long jobs cannot starve beyond the queue timeout.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float, client_max_in_flight: int = 0,
+                 scheduling: str = "fifo"):
+        """
+        Args:
+            max_in_flight (int): Maximum number of concurrently running extractions.
+            max_queue (int): Maximum number of requests waiting for a slot.
+            queue_timeout (float): Seconds a request may wait for a slot.
+            client_max_in_flight (int): Maximum running plus waiting requests per client, 0 disables quotas.
+            scheduling (str): "fifo" or "sjf" (shortest expected job first).
+        """
+        if scheduling not in {"fifo", "sjf"}:
+            raise ValueError(f"Unsupported admission scheduling: {scheduling}")
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.client_max_in_flight = client_max_in_flight
+        self.scheduling = scheduling
+        self.logger = get_logger("AdmissionController")
+
+        self._free_slots = max_in_flight
+        # Heap of [priority, arrival, future] of the requests waiting for a slot
+        self._waiters: List[list] = []
+        self._arrivals = itertools.count()
+        self.in_flight = 0
+        self.waiting = 0
+        self._client_requests: Dict[str, int] = {}
+        # Exponentially weighted mean service time, used to estimate Retry-After
+        self._mean_service_seconds = 5.0
+
+        metrics.register_gauge("admission_in_flight", lambda: self.in_flight)
+        metrics.register_gauge("admission_queue_depth", lambda: self.waiting)
+
+    def _retry_after(self) -> int:
+        """
+        Estimates the seconds until the queue ahead of a new request has drained.
+        """
+        backlog = (self.waiting + 1) / max(self.max_in_flight, 1)
+        return max(1, math.ceil(backlog * self._mean_service_seconds))
+
+    def _reject(self, status_code: int, reason: str) -> AdmissionRejected:
+        metrics.increment("admission_rejected_total", reason=reason)
+        self.logger.warning(f"Rejected request: {reason} (in flight {self.in_flight}, queued {self.waiting})")
+        return AdmissionRejected(status_code, reason, self._retry_after())
+
+    async def _acquire(self, expected_seconds: float, timeout: float) -> None:
+        """
+        Takes a free slot, or waits in the queue until a slot is handed over.
+
+        Raises:
+            asyncio.TimeoutError: If no slot was handed over within the timeout.
+        """
+        if self._free_slots and not self._waiters:
+            self._free_slots -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        priority = expected_seconds if self.scheduling == "sjf" else 0.0
+        entry = [priority, next(self._arrivals), future]
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(future, timeout=timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the wait ended, pass it on
+                self._release()
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def _release(self) -> None:
+        """
+        Hands the slot over to the next waiting request, or frees it.
+        """
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free_slots += 1
+
+    @asynccontextmanager
+    async def admit(self, client_id: Optional[str] = None, timeout: Optional[float] = None,
+                    expected_seconds: float = 0.0) -> AsyncIterator[None]:
+        """
+        Holds an extraction slot for the duration of the context.
+
+        Args:
+            client_id (str, optional): Identifies the caller for per-client quotas.
+            timeout (float, optional): Shorter wait for a slot than queue_timeout, e.g. the request deadline.
+            expected_seconds (float): Expected duration of the job, orders the queue with "sjf" scheduling.
+
+        Raises:
+            AdmissionRejected: If the client quota, the queue or the queue deadline is exceeded.
+        """
+        if self.client_max_in_flight and client_id is not None:
+            if self._client_requests.get(client_id, 0) >= self.client_max_in_flight:
+                raise self._reject(429, "client_quota")
+        if self.in_flight + self.waiting >= self.max_in_flight + self.max_queue:
+            raise self._reject(503, "queue_full")
+
+        if client_id is not None:
+            self._client_requests[client_id] = self._client_requests.get(client_id, 0) + 1
+        try:
+            queued_at = time.perf_counter()
+            self.waiting += 1
+            try:
+                queue_timeout = self.queue_timeout if timeout is None else max(min(timeout, self.queue_timeout), 0)
+                await self._acquire(expected_seconds, queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._reject(503, "queue_timeout")
+            finally:
+                self.waiting -= 1
+            metrics.increment("admission_admitted_total")
+            metrics.increment("admission_queue_wait_seconds_total", time.perf_counter() - queued_at)
+
+            started = time.perf_counter()
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+                self._release()
+                self._mean_service_seconds = 0.8 * self._mean_service_seconds + 0.2 * (time.perf_counter() - started)
+        finally:
+            if client_id is not None:
+                remaining = self._client_requests[client_id] - 1
+                if remaining:
+                    self._client_requests[client_id] = remaining
+                else:
+                    del self._client_requests[client_id]
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Returns the shared admission controller, created from the settings on first use.
+    """
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(settings.admission_max_in_flight, settings.admission_max_queue,
+                                                    settings.admission_queue_timeout,
+                                                    settings.admission_client_max_in_flight,
+                                                    settings.admission_scheduling)
+    return _admission_controller
@@ -0,0 +1,370 @@
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.cancellation import CancellationToken
+from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+
+# Minimum seconds between two checks of LLM_API_KEYS_FILE for changes
+KEYS_FILE_CHECK_SECONDS = 5.0
+
+
+class NoKeyAvailable(Exception):
+    """
+    Raised when every key of the pool is evicted or out of budget for longer than the wait timeout.
+    """
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously up to its capacity per minute. A capacity of 0 means no budget:
+    the bucket never runs empty.
+    """
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.limited = per_minute > 0
+        self.capacity = float(per_minute) if self.limited else math.inf
+        self.tokens = self.capacity
+        self.refill_per_second = per_minute / 60.0
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def available(self) -> float:
+        if not self.limited:
+            return math.inf
+        self._refill()
+        return self.tokens
+
+    def used(self) -> float:
+        """
+        Returns the fraction of the capacity in use, 0 for an unlimited bucket.
+        """
+        return 1 - self.available() / self.capacity if self.limited else 0.0
+
+    def seconds_until(self, amount: float) -> float:
+        """
+        Returns the seconds until the given amount is available.
+        """
+        if not self.limited:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing, 0) / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        """
+        Takes tokens from the bucket, a negative amount returns them. The bucket may go negative when
+        the actual usage exceeds the estimate.
+        """
+        if not self.limited:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class ApiKey:
+    """
+    One API key of the pool, with its client, request and token budgets and usage statistics.
+    """
+
+    def __init__(self, api_key: str, organization: Optional[str], requests_per_minute: int, tokens_per_minute: int,
+                 clock: Callable[[], float] = time.monotonic):
+        self.api_key = api_key
+        self.organization = organization
+        self.name = f"...{api_key[-4:]}" if len(api_key) > 8 else "key"
+        self.requests = TokenBucket(requests_per_minute, clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock)
+        self.client = None
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.errors = 0
+        self.evicted_until = 0.0
+
+    def create_client(self):
+        if self.client is None:
+            # Imported lazily: the openai package is the most expensive import of the service
+            from openai import OpenAI
+
+            self.client = OpenAI(api_key=self.api_key, organization=self.organization)
+        return self.client
+
+    def load(self) -> float:
+        """
+        Fraction of the token budget in use, the key with the lowest load is selected first.
+        """
+        return self.tokens.used() + self.in_flight / 1000
+
+
+class ApiKeyPool:
+    """
+    Spreads LLM requests over several API keys. Each key has per-minute request and token budgets;
+    the least-loaded key with enough budget is leased, and keys that fail with auth or quota errors
+    are evicted for a while.
+
+    With a keys file, the file is checked for changes while keys are leased and the key set is
+    replaced without a restart.
+    """
+
+    def __init__(self, keys: List[ApiKey], eviction_seconds: float, wait_timeout: float,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                 keys_file: Optional[str] = None,
+                 key_factory: Optional[Callable[[str, Optional[str]], ApiKey]] = None):
+        """
+        Args:
+            keys (List[ApiKey]): The keys of the pool.
+            eviction_seconds (float): How long a key failing with an auth or quota error is skipped.
+            wait_timeout (float): Maximum seconds to wait for a key with enough budget.
+            clock (Callable[[], float]): Monotonic clock of the evictions and waits, the keys' buckets use their own.
+            sleep (Callable[[float], None]): Waits while no key has budget.
+            keys_file (str, optional): File the keys were read from, reloaded when it changes.
+            key_factory (Callable[[str, Optional[str]], ApiKey], optional): Creates the keys added by a reload.
+        """
+        if not keys:
+            raise ValueError("No LLM API key configured, set LLM_API_KEY or LLM_API_KEYS")
+        self.keys = keys
+        self.eviction_seconds = eviction_seconds
+        self.wait_timeout = wait_timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.keys_file = keys_file
+        self.key_factory = key_factory
+        self.logger = get_logger("ApiKeyPool")
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._keys_file_mtime = _mtime(keys_file) if keys_file else None
+        self._next_keys_check = clock() + KEYS_FILE_CHECK_SECONDS
+        metrics.register_gauge("llm_key_utilization", self.utilization)
+
+    def create_clients(self) -> None:
+        """
+        Creates the client of every key ahead of the first request.
+        """
+        for key in self.keys:
+            key.create_client()
+
+    def acquire(self, estimated_tokens: int, cancellation: Optional[CancellationToken] = None) -> ApiKey:
+        """
+        Leases the least-loaded key that is not evicted and has budget for one request of the estimated size,
+        waiting for budgets to refill if necessary.
+
+        Args:
+            estimated_tokens (int): Expected prompt plus completion tokens of the request.
+            cancellation (CancellationToken, optional): Cancellation of the request, checked whenever the
+                wait wakes up. The wait does not outlast the request deadline.
+
+        Returns:
+            ApiKey: The leased key, to be passed to release().
+
+        Raises:
+            NoKeyAvailable: If no key has budget within the wait timeout.
+            RequestCancelled: If the request is cancelled while waiting.
+        """
+        self._check_keys_file()
+        give_up_at = self.clock() + self.wait_timeout
+        while True:
+            if cancellation:
+                cancellation.raise_if_cancelled()
+            with self._lock:
+                now = self.clock()
+                candidates = [key for key in self.keys if key.evicted_until <= now]
+                ready = [key for key in candidates
+                         if key.requests.available() >= 1 and key.tokens.available() >= min(estimated_tokens,
+                                                                                             key.tokens.capacity)]
+                if ready:
+                    key = min(ready, key=ApiKey.load)
+                    key.requests.consume(1)
+                    key.tokens.consume(estimated_tokens)
+                    key.in_flight += 1
+                    key.create_client()
+                    return key
+
+                if candidates:
+                    wait = min(max(key.requests.seconds_until(1), key.tokens.seconds_until(estimated_tokens))
+                               for key in candidates)
+                else:
+                    wait = min(key.evicted_until for key in self.keys) - now
+
+            if now + wait > give_up_at:
+                metrics.increment("llm_key_exhausted_total")
+                raise NoKeyAvailable(f"No API key with budget for {estimated_tokens} tokens "
+                                     f"within {self.wait_timeout}s")
+            pause = min(max(wait, 0.01), 1.0)
+            remaining = cancellation.remaining() if cancellation else None
+            if remaining is not None:
+                # Wake up at the deadline, the next check raises
+                pause = min(pause, max(remaining, 0.0))
+            self.sleep(pause)
+
+    def release(self, key: ApiKey, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """
+        Returns a leased key and corrects its token budget with the actual usage.
+
+        Args:
+            key (ApiKey): The leased key.
+            estimated_tokens (int): The estimate the key was leased with.
+            actual_tokens (int, optional): Tokens reported in the usage, None if the request failed.
+        """
+        with self._lock:
+            key.in_flight -= 1
+            key.total_requests += 1
+            key.tokens.consume((actual_tokens or 0) - estimated_tokens)
+            key.total_tokens += actual_tokens or 0
+            retired = key.in_flight == 0 and key not in self.keys
+        if retired and key.client is not None:
+            # Last request of a key removed by a reload
+            key.client.close()
+        metrics.increment("llm_key_requests_total", key=key.name)
+
+    def evict(self, key: ApiKey, error: Exception, seconds: Optional[float] = None) -> None:
+        """
+        Skips a key that failed with an auth or quota error.
+
+        Args:
+            key (ApiKey): The failing key.
+            error (Exception): The error returned for the key.
+            seconds (float, optional): Eviction time, defaults to the pool's eviction_seconds.
+        """
+        seconds = self.eviction_seconds if seconds is None else seconds
+        with self._lock:
+            key.errors += 1
+            key.evicted_until = self.clock() + seconds
+        metrics.increment("llm_key_evictions_total", key=key.name)
+        self.logger.warning(f"Evicted API key {key.name} for {seconds}s: {type(error).__name__}")
+
+    def reload(self, keys: List[ApiKey]) -> None:
+        """
+        Replaces the key set. Keys that remain keep their budgets, statistics and client; removed keys
+        finish their in-flight requests and are closed afterwards.
+
+        Args:
+            keys (List[ApiKey]): The new keys of the pool.
+        """
+        if not keys:
+            raise ValueError("A key pool needs at least one key")
+        with self._lock:
+            current = {(key.api_key, key.organization): key for key in self.keys}
+            self.keys = [current.pop((key.api_key, key.organization), key) for key in keys]
+            removed = list(current.values())
+            idle = [key for key in removed if key.in_flight == 0 and key.client is not None]
+        for key in idle:
+            key.client.close()
+        metrics.increment("llm_key_reloads_total")
+        self.logger.info(f"Reloaded API keys: {len(self.keys)} keys, removed "
+                         f"{', '.join(key.name for key in removed) or 'none'}")
+
+    def _check_keys_file(self) -> None:
+        """
+        Reloads the keys when the keys file changed, checked at most every KEYS_FILE_CHECK_SECONDS.
+        """
+        if not self.keys_file or self.clock() < self._next_keys_check:
+            return
+        # One thread checks, the others lease from the current keys meanwhile
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_keys_check = self.clock() + KEYS_FILE_CHECK_SECONDS
+            mtime = _mtime(self.keys_file)
+            if mtime is None or mtime == self._keys_file_mtime:
+                return
+            self._keys_file_mtime = mtime
+            entries = read_keys_file(self.keys_file)
+            if not entries:
+                self.logger.warning(f"{self.keys_file} lists no keys, keeping the current keys")
+                return
+            self.reload([self.key_factory(api_key, organization) for api_key, organization in entries])
+        except OSError as e:
+            self.logger.warning(f"Could not reload API keys from {self.keys_file}: {e}")
+        finally:
+            self._reload_lock.release()
+
+    def has_available_key(self) -> bool:
+        now = self.clock()
+        return any(key.evicted_until <= now for key in self.keys)
+
+    def utilization(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns:
+            Dict[str, Dict[str, Any]]: Budget usage and statistics per key.
+        """
+        now = self.clock()
+        with self._lock:
+            return {
+                key.name: {
+                    "in_flight": key.in_flight,
+                    "request_budget_used": round(key.requests.used(), 3),
+                    "token_budget_used": round(key.tokens.used(), 3),
+                    "requests": key.total_requests,
+                    "tokens": key.total_tokens,
+                    "errors": key.errors,
+                    "evicted_seconds": round(max(key.evicted_until - now, 0), 1),
+                }
+                for key in self.keys
+            }
+
+    def close(self) -> None:
+        for key in self.keys:
+            if key.client is not None:
+                key.client.close()
+                key.client = None
+
+
+def parse_key_entries(entries: str, fallback_key: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    Parses LLM_API_KEYS, comma-separated "key" or "key:organization" entries. Falls back to the single LLM_API_KEY.
+    """
+    parsed = []
+    for entry in entries.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        api_key, _, organization = entry.partition(":")
+        parsed.append((api_key.strip(), organization.strip() or None))
+    if not parsed and fallback_key:
+        parsed.append((fallback_key, None))
+    return parsed
+
+
+def read_keys_file(path: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    Reads LLM_API_KEYS_FILE, entries as in LLM_API_KEYS separated by commas or newlines.
+    """
+    with open(path) as file:
+        return parse_key_entries(file.read().replace("\n", ","), "")
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def create_key_pool(fallback_key: str = "") -> ApiKeyPool:
+    """
+    Builds the key pool from the settings. With LLM_API_KEYS_FILE the keys are read from that file and
+    reloaded when it changes, otherwise from LLM_API_KEYS.
+
+    Args:
+        fallback_key (str): Key used when LLM_API_KEYS is empty, defaults to LLM_API_KEY.
+    """
+    def create_key(api_key: str, organization: Optional[str]) -> ApiKey:
+        return ApiKey(api_key, organization, settings.llm_key_requests_per_minute, settings.llm_key_tokens_per_minute)
+
+    keys_file = settings.llm_api_keys_file or None
+    if keys_file:
+        entries = read_keys_file(keys_file)
+    else:
+        entries = parse_key_entries(settings.llm_api_keys, fallback_key or settings.llm_api_key)
+    keys = [create_key(api_key, organization) for api_key, organization in entries]
+    return ApiKeyPool(keys, settings.llm_key_eviction_seconds, settings.llm_key_wait_timeout,
+                      keys_file=keys_file, key_factory=create_key)
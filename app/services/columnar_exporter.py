@@ -0,0 +1,337 @@
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.logger import get_logger
+
+RECORD_ID = "_record_id"
+ROW_ID = "_id"
+PARENT_ID = "_parent_id"
+INDEX = "_index"
+
+# JSON schema types mapped to the kind of column they are written as
+_SCALAR_KINDS = {"string": "string", "integer": "int64", "number": "float64", "boolean": "bool"}
+
+
+@dataclass
+class TableSpec:
+    """
+    Columnar layout of one table: the scalar columns taken from each row object and the
+    arrays below it that become child tables.
+    """
+    name: str
+    columns: List[Tuple[str, Tuple[str, ...], str]] = field(default_factory=list)
+    children: List[Tuple[Tuple[str, ...], "TableSpec"]] = field(default_factory=list)
+
+
+def _import_pyarrow():
+    """
+    Imports pyarrow lazily, it is only needed when results are exported.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError as e:
+        raise ImportError("Columnar export requires pyarrow, install it with `pip install pyarrow`") from e
+
+
+class ColumnarExporter:
+    """
+    Flattens structured results into related columnar tables following the response schema and
+    writes them as Parquet or Arrow files in row-group batches.
+
+    Nested objects become dotted columns of their table, arrays of objects or scalars become child
+    tables carrying the `_record_id` of the result, the `_parent_id` of the row they belong to and
+    their `_index` in the array. At most `row_group_size` rows per table are buffered in memory.
+    """
+
+    def __init__(self, response_schema: Dict[str, Any], output_dir: str, row_group_size: int = 10000,
+                 file_format: str = "parquet", root_name: str = "root"):
+        """
+        Args:
+            response_schema (Dict[str, Any]): The response format from ResponseSchemaGenerator, or its inner schema.
+            output_dir (str): Directory the table files are written to, one file per table.
+            row_group_size (int): Rows buffered per table before a row group is written.
+            file_format (str): "parquet" or "arrow" (Arrow IPC file).
+            root_name (str): Name of the table holding one row per result.
+        """
+        if file_format not in {"parquet", "arrow"}:
+            raise ValueError(f"Unsupported export format: {file_format}")
+        self.pa = _import_pyarrow()
+        self.logger = get_logger("ColumnarExporter")
+
+        schema = response_schema.get("json_schema", {}).get("schema", response_schema)
+        self.defs = schema.get("$defs", {})
+        self.output_dir = output_dir
+        self.row_group_size = row_group_size
+        self.file_format = file_format
+        self.root = TableSpec(root_name)
+        self._plan(schema, (), self.root)
+
+        self.tables: Dict[str, TableSpec] = {}
+        self._collect_tables(self.root)
+        self._buffers: Dict[str, List[Dict[str, Any]]] = {name: [] for name in self.tables}
+        self._next_ids: Dict[str, int] = {name: 0 for name in self.tables}
+        self._writers: Dict[str, Any] = {}
+        self._arrow_schemas = {name: self._arrow_schema(spec) for name, spec in self.tables.items()}
+        self.records_written = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _resolve(self, schema: Dict[str, Any]) -> Dict[str, Any]:
+        ref = schema.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/$defs/"):
+            return self._resolve(self.defs.get(ref.split("/")[-1], {}))
+        return schema
+
+    @staticmethod
+    def _types(schema: Dict[str, Any]) -> List[str]:
+        schema_type = schema.get("type")
+        types = schema_type if isinstance(schema_type, list) else [schema_type]
+        return [t for t in types if t != "null"]
+
+    def _plan(self, schema: Dict[str, Any], path: Tuple[str, ...], table: TableSpec) -> None:
+        """
+        Walks the schema and assigns every value to a column of the current table or to a child table.
+        """
+        schema = self._resolve(schema)
+        types = self._types(schema)
+
+        if types == ["object"]:
+            for key, value in schema.get("properties", {}).items():
+                self._plan(value, path + (key,), table)
+        elif types == ["array"]:
+            name_parts = ([] if table is self.root else [table.name]) + list(path or ("items",))
+            child = TableSpec(".".join(name_parts))
+            self._plan(schema.get("items", {}), (), child)
+            table.children.append((path, child))
+        else:
+            kind = _SCALAR_KINDS.get(types[0], "string") if len(types) == 1 else "string"
+            table.columns.append((".".join(path) or "value", path, kind))
+
+    def _collect_tables(self, table: TableSpec) -> None:
+        self.tables[table.name] = table
+        for _, child in table.children:
+            self._collect_tables(child)
+
+    def _arrow_schema(self, table: TableSpec):
+        pa = self.pa
+        arrow_types = {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_()}
+        fields = [pa.field(RECORD_ID, pa.string(), nullable=False), pa.field(ROW_ID, pa.int64(), nullable=False)]
+        if table is not self.root:
+            fields += [pa.field(PARENT_ID, pa.int64(), nullable=False), pa.field(INDEX, pa.int64(), nullable=False)]
+        fields += [pa.field(name, arrow_types[kind]) for name, _, kind in table.columns]
+        return pa.schema(fields)
+
+    @staticmethod
+    def _get(value: Any, path: Tuple[str, ...]) -> Any:
+        for key in path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+
+    @staticmethod
+    def _coerce(value: Any, kind: str) -> Any:
+        if value is None:
+            return None
+        if kind == "string":
+            return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        if kind == "bool":
+            return value if isinstance(value, bool) else None
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        if kind == "int64":
+            return int(value) if float(value).is_integer() else None
+        return float(value)
+
+    def add(self, record: Dict[str, Any], record_id: Optional[str] = None) -> str:
+        """
+        Flattens one structured result into the table buffers, writing full row groups.
+
+        Args:
+            record (Dict[str, Any]): The validated structured output.
+            record_id (str, optional): Id carried by every row of the result. Defaults to a running number.
+
+        Returns:
+            str: The record id.
+        """
+        record_id = record_id or str(self.records_written)
+        self._add_row(self.root, record, record_id, None, None)
+        self.records_written += 1
+        for name, rows in self._buffers.items():
+            if len(rows) >= self.row_group_size:
+                self._flush(name)
+        return record_id
+
+    def add_many(self, records: Iterable[Dict[str, Any]]) -> None:
+        for record in records:
+            self.add(record)
+
+    def _add_row(self, table: TableSpec, value: Any, record_id: str, parent_id: Optional[int],
+                 index: Optional[int]) -> None:
+        row_id = self._next_ids[table.name]
+        self._next_ids[table.name] += 1
+
+        row = {RECORD_ID: record_id, ROW_ID: row_id}
+        if parent_id is not None:
+            row[PARENT_ID] = parent_id
+            row[INDEX] = index
+        for name, path, kind in table.columns:
+            row[name] = self._coerce(self._get(value, path), kind)
+        self._buffers[table.name].append(row)
+
+        for path, child in table.children:
+            items = self._get(value, path)
+            if isinstance(items, list):
+                for position, item in enumerate(items):
+                    self._add_row(child, item, record_id, row_id, position)
+
+    def _file_path(self, table_name: str) -> str:
+        extension = "parquet" if self.file_format == "parquet" else "arrow"
+        return os.path.join(self.output_dir, f"{table_name}.{extension}")
+
+    def _flush(self, table_name: str) -> None:
+        rows = self._buffers[table_name]
+        if not rows:
+            return
+        batch = self.pa.RecordBatch.from_pylist(rows, schema=self._arrow_schemas[table_name])
+        writer = self._writers.get(table_name)
+        if writer is None:
+            if self.file_format == "parquet":
+                writer = self.pa.parquet.ParquetWriter(self._file_path(table_name), self._arrow_schemas[table_name])
+            else:
+                writer = self.pa.ipc.new_file(self._file_path(table_name), self._arrow_schemas[table_name])
+            self._writers[table_name] = writer
+        if self.file_format == "parquet":
+            writer.write_batch(batch, row_group_size=len(rows))
+        else:
+            writer.write_batch(batch)
+        self._buffers[table_name] = []
+
+    def close(self) -> List[str]:
+        """
+        Writes the remaining buffered rows and finalizes the files.
+
+        Returns:
+            List[str]: Paths of the written table files.
+        """
+        for name in self.tables:
+            self._flush(name)
+        paths = []
+        for name, writer in self._writers.items():
+            writer.close()
+            paths.append(self._file_path(name))
+        self._writers = {}
+        self.logger.info(f"Exported {self.records_written} records to {len(paths)} tables in {self.output_dir}")
+        return paths
+
+
+class ExportManager:
+    """
+    Streams validated results of the service into one exporter per extraction profile. Files are
+    rotated after `export_records_per_file` results, since a Parquet file is only readable once closed.
+    """
+
+    def __init__(self, export_dir: str):
+        self.export_dir = export_dir
+        self._exporters: Dict[str, ColumnarExporter] = {}
+        self._parts: Dict[str, int] = {}
+        # Part numbers restart with every process, the start time and a random suffix keep the part names of
+        # restarts (the server is PID 1 in the container) from overwriting earlier exports
+        self._run_id = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+
+    def add(self, profile: str, response_schema: Dict[str, Any], record: Dict[str, Any], record_id: str) -> None:
+        """
+        Adds a validated result to the exporter of its profile.
+
+        Args:
+            profile (str): Profile hash of the request, results of a profile share one table layout.
+            response_schema (Dict[str, Any]): The response format the result was extracted with.
+            record (Dict[str, Any]): The validated structured output.
+            record_id (str): Id carried by every row of the result.
+        """
+        with self._lock:
+            exporter = self._exporters.get(profile)
+            if exporter is None:
+                part = self._parts.get(profile, 0)
+                self._parts[profile] = part + 1
+                output_dir = os.path.join(self.export_dir, profile[:16], f"part-{self._run_id}-{part:05d}")
+                exporter = ColumnarExporter(response_schema, output_dir, settings.export_row_group_size,
+                                            settings.export_format)
+                self._exporters[profile] = exporter
+            exporter.add(record, record_id)
+            if exporter.records_written >= settings.export_records_per_file:
+                exporter.close()
+                del self._exporters[profile]
+
+    def close(self) -> None:
+        """
+        Finalizes all open exporters.
+        """
+        with self._lock:
+            for exporter in self._exporters.values():
+                exporter.close()
+            self._exporters = {}
+
+
+_export_manager: Optional[ExportManager] = None
+_export_manager_lock = threading.Lock()
+
+
+def get_export_manager() -> Optional[ExportManager]:
+    """
+    Returns the shared export manager, or None if EXPORT_DIR is not configured.
+    """
+    global _export_manager
+    if not settings.export_dir:
+        return None
+    with _export_manager_lock:
+        if _export_manager is None:
+            _export_manager = ExportManager(settings.export_dir)
+        return _export_manager
+
+
+def close_export_manager() -> None:
+    """
+    Finalizes the files of the shared export manager, called on shutdown.
+    """
+    if _export_manager is not None:
+        _export_manager.close()
+
+
+def _iter_records(path: str) -> Iterable[Dict[str, Any]]:
+    with open(path) as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            data = json.load(file)
+            yield from (data if isinstance(data, list) else [data])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export structured JSON results to columnar tables")
+    parser.add_argument("schema", help="Response format JSON file (json_file of the API)")
+    parser.add_argument("output_dir", help="Directory for the table files")
+    parser.add_argument("inputs", nargs="+", help="JSON or JSONL files with structured results")
+    parser.add_argument("--format", default="parquet", choices=["parquet", "arrow"])
+    parser.add_argument("--row-group-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    with open(args.schema) as schema_file:
+        schema_data = json.load(schema_file)
+    columnar_exporter = ColumnarExporter(schema_data, args.output_dir, args.row_group_size, args.format)
+    for input_path in args.inputs:
+        columnar_exporter.add_many(_iter_records(input_path))
+    for table_path in columnar_exporter.close():
+        print(table_path)
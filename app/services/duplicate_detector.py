@@ -0,0 +1,243 @@
+import json
+import os
+import re
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.utils.hashing import content_hash
+from app.utils.logger import get_logger
+
+# Mersenne prime 2^31 - 1: (a * x + b) stays below 2^63 for 32-bit shingle hashes, so uint64 never overflows
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_ESCAPES = re.compile(r"\\[nrt]")
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a text for near-duplicate comparison: escaped and real whitespace, punctuation and
+    case differences are removed.
+
+    Args:
+        text (str): The unstructured text as parsed by InputFileParser.
+
+    Returns:
+        str: Lower-cased words separated by single spaces.
+    """
+    if text.startswith(("b'", 'b"')) and len(text) > 3:
+        text = text[2:-1]
+    text = _ESCAPES.sub(" ", text)
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures over character shingles of normalized text.
+    """
+
+    def __init__(self, num_perm: int, shingle_size: int, seed: int = 1):
+        """
+        Args:
+            num_perm (int): Number of hash permutations, i.e. the signature length.
+            shingle_size (int): Number of characters per shingle.
+            seed (int): Seed of the permutation coefficients. Persisted signatures are only comparable
+                for the same seed, num_perm and shingle_size.
+        """
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_MERSENNE_PRIME), size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, int(_MERSENNE_PRIME), size=(num_perm, 1), dtype=np.uint64)
+
+    @property
+    def params(self) -> Dict[str, int]:
+        """
+        The parameters a signature depends on, stored with every persisted signature.
+        """
+        return {"num_perm": self.num_perm, "shingle_size": self.shingle_size, "seed": self.seed}
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        size = self.shingle_size
+        if len(text) <= size:
+            shingles = {text}
+        else:
+            shingles = {text[i:i + size] for i in range(len(text) - size + 1)}
+        return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+    def signature(self, normalized_text: str) -> np.ndarray:
+        """
+        Args:
+            normalized_text (str): Text returned by normalize_text.
+
+        Returns:
+            np.ndarray: The MinHash signature, shape (num_perm,).
+        """
+        hashes = self._shingle_hashes(normalized_text)
+        return ((self._a * hashes + self._b) % _MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+
+class DuplicateIndex:
+    """
+    Locality-sensitive hashing index over MinHash signatures of already extracted documents,
+    persisted to a local directory. Entries are scoped by extraction profile, a stored result is
+    only offered for a text extracted with the same examples and schema.
+
+    Each added document is appended to a JSONL journal, so persisting costs one line per request
+    regardless of the size of the index. A later line for the same id replaces the earlier result.
+    Lines carry the MinHash parameters of their signature, lines written with other parameters are ignored.
+    """
+
+    JOURNAL_FILE = "entries.jsonl"
+
+    def __init__(self, store_dir: str, num_perm: int, bands: int, shingle_size: int, threshold: float):
+        """
+        Args:
+            store_dir (str): Directory the index is persisted to.
+            num_perm (int): Signature length, must be divisible by bands.
+            bands (int): Number of LSH bands. More bands find candidates at lower similarity.
+            shingle_size (int): Number of characters per shingle.
+            threshold (float): Minimum estimated Jaccard similarity to report a near-duplicate.
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.store_dir = store_dir
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.logger = get_logger("DuplicateIndex")
+
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        # Grown by doubling, rows past len(self._entries) are unused
+        self._signatures = np.empty((64, num_perm), dtype=np.uint32)
+        self._entries: List[Dict[str, Any]] = []
+        self._ids: Dict[str, int] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._load()
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def _add_to_buckets(self, position: int, signature: np.ndarray) -> None:
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, []).append(position)
+
+    def find(self, text: str, profile: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        Looks up the most similar already extracted document with the same profile.
+
+        Args:
+            text (str): The unstructured text.
+            profile (str): Profile hash of the request.
+
+        Returns:
+            Optional[Tuple[Dict[str, Any], float]]: The stored entry and its estimated similarity,
+            or None if no document reaches the threshold.
+        """
+        normalized = normalize_text(text)
+        signature = self.hasher.signature(normalized)
+        with self._lock:
+            candidates = {position for band, key in enumerate(self._band_keys(signature))
+                          for position in self._buckets[band].get(key, ())}
+            candidates = [position for position in candidates if self._entries[position]["profile"] == profile]
+            if not candidates:
+                return None
+
+            positions = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            similarities = (self._signatures[positions] == signature).mean(axis=1)
+            best = int(similarities.argmax())
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return None
+            return self._entries[positions[best]], similarity
+
+    def add(self, text: str, profile: str, result: Dict[str, Any]) -> str:
+        """
+        Adds an extracted document to the index and appends it to the journal.
+
+        Args:
+            text (str): The unstructured text.
+            profile (str): Profile hash the text was extracted with.
+            result (Dict[str, Any]): The validated structured output.
+
+        Returns:
+            str: The id of the entry, the hash of the normalized text and profile.
+        """
+        normalized = normalize_text(text)
+        document_id = content_hash(f"{profile}:{normalized}")
+        signature = self.hasher.signature(normalized)
+        with self._lock:
+            self._insert(document_id, profile, result, signature)
+        line = json.dumps({"id": document_id, "profile": profile, **self.hasher.params,
+                           "signature": signature.tobytes().hex(), "result": result}, ensure_ascii=False) + "\n"
+        # Only the append is serialized, lookups and other additions do not wait for the disk
+        with self._journal_lock, open(os.path.join(self.store_dir, self.JOURNAL_FILE), "a") as file:
+            file.write(line)
+        return document_id
+
+    def _insert(self, document_id: str, profile: str, result: Dict[str, Any], signature: np.ndarray) -> None:
+        if document_id in self._ids:
+            self._entries[self._ids[document_id]]["result"] = result
+            return
+        position = len(self._entries)
+        self._entries.append({"id": document_id, "profile": profile, "result": result})
+        self._ids[document_id] = position
+        if position == len(self._signatures):
+            self._signatures = np.concatenate([self._signatures, np.empty_like(self._signatures)])
+        self._signatures[position] = signature
+        self._add_to_buckets(position, signature)
+
+    def _load(self) -> None:
+        os.makedirs(self.store_dir, exist_ok=True)
+        journal_path = os.path.join(self.store_dir, self.JOURNAL_FILE)
+        params = self.hasher.params
+        if os.path.exists(journal_path):
+            skipped = incompatible = 0
+            with open(journal_path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut off by a crash
+                        skipped += 1
+                        continue
+                    # Signatures of other MinHash parameters are not comparable to the current ones
+                    if any(entry.get(name) != value for name, value in params.items()):
+                        incompatible += 1
+                        continue
+                    signature = np.frombuffer(bytes.fromhex(entry["signature"]), dtype=np.uint32)
+                    self._insert(entry["id"], entry["profile"], entry["result"], signature)
+            if incompatible:
+                self.logger.warning(f"Ignored {incompatible} duplicate index entries written with other "
+                                    f"MinHash parameters than {params}")
+            if skipped:
+                self.logger.warning(f"Skipped {skipped} unreadable duplicate index entries")
+                # Terminate a cut-off last line, the next entry must start on a line of its own
+                with open(journal_path, "rb+") as file:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b"\n":
+                        file.write(b"\n")
+        if self._entries:
+            self.logger.info(f"Loaded duplicate index with {len(self._entries)} documents")
+
+
+_index: Optional[DuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_duplicate_index() -> DuplicateIndex:
+    """
+    Returns the shared duplicate index, loading it from disk on first use.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DuplicateIndex(settings.dedup_store_dir, settings.dedup_num_perm, settings.dedup_bands,
+                                    settings.dedup_shingle_size, settings.dedup_threshold)
+        return _index
@@ -1,10 +1,20 @@
-from openai import (OpenAI, APIError, APIConnectionError, APITimeoutError, AuthenticationError, BadRequestError,
-                    ConflictError, InternalServerError, NotFoundError, PermissionDeniedError, RateLimitError,
-                    UnprocessableEntityError)
+from app.core.config import settings
+from app.services.output_budget import OutputBudget, OutputTimeout, OutputTruncated, get_output_estimator
+from app.utils.cancellation import CancellationToken, RequestCancelled
 from app.utils.logger import get_logger
-from typing import Dict, Any
+from app.utils.metrics import metrics
+from app.utils.tokens import count_prompt_tokens
+from collections import Counter
+from typing import Dict, Any, Optional, Tuple, TYPE_CHECKING
+import threading
 import time
 
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+    from app.services.api_key_pool import ApiKeyPool
+
+
 class GPTService:
     """
     Service for interacting with OpenAI GPT-4 model
@@ -13,44 +23,84 @@ class GPTService:
     DEFAULT_TEMPERATURE = 0
     DEFAULT_TOP_P = 0
 
-    _client_instance = None
+    # Completion tokens assumed when leasing a key, corrected with the actual usage afterwards
+    COMPLETION_TOKENS_ESTIMATE = 1000
+
+    _key_pool: Optional["ApiKeyPool"] = None
 
     @staticmethod
-    def _create_client_instance(api_key: str) -> OpenAI:
+    def _create_key_pool(api_key: str) -> "ApiKeyPool":
         """
-        Creates a new instance of the OpenAI client.
+        Creates the pool of API keys with one OpenAI client per key.
 
         Args:
-            api_key (str): The OpenAI API key.
+            api_key (str): The OpenAI API key used when no key pool is configured.
 
         Returns:
-            OpenAIClient: A new instance of the OpenAI client.
+            ApiKeyPool: The key pool.
         """
+        from app.services.api_key_pool import create_key_pool
 
-        try:
-            client = OpenAI(api_key=api_key)
-            return client
-        except AuthenticationError:
-            raise
+        return create_key_pool(api_key)
 
     def __init__(self, api_key: str):
         """
-        Initializes the GPTService instance with an OpenAI client
+        Initializes the GPTService instance with the shared pool of OpenAI clients
 
         Args:
-            api_key (str): The OpenAI API key for authenticating API requests.
+            api_key (str): The OpenAI API key for authenticating API requests, used when no key pool is configured.
         """
         self.logger = get_logger("GPTService")
         self.logger.info("Initializing GPTService")
 
-        if not GPTService._client_instance:
-            GPTService._client_instance = self._create_client_instance(api_key)
-            self.logger.info("Created a new OpenAI client instance")
+        if not GPTService._key_pool:
+            GPTService._key_pool = self._create_key_pool(api_key)
+            self.logger.info(f"Created a pool of {len(GPTService._key_pool.keys)} OpenAI API keys")
 
-        self.client = GPTService._client_instance
+        self.key_pool = GPTService._key_pool
+        # Shards of a request complete concurrently on one instance, each thread keeps its own usage
+        self._local = threading.local()
+        # Token usage summed over all completions of this instance
+        self.usage_totals = Counter()
+        self._usage_lock = threading.Lock()
+        # Set to a list to collect the capture entries of the completions of this instance
+        self.captured: Optional[list] = None
+
+    @property
+    def last_usage(self):
+        """
+        Usage of the last completion of the calling thread.
+        """
+        return getattr(self._local, "usage", None)
+
+    @last_usage.setter
+    def last_usage(self, usage) -> None:
+        self._local.usage = usage
+
+    @classmethod
+    def warm_up(cls, api_key: str) -> None:
+        """
+        Creates the shared key pool and its OpenAI clients ahead of the first request.
+
+        Args:
+            api_key (str): The OpenAI API key used when no key pool is configured.
+        """
+        if not cls._key_pool:
+            cls._key_pool = cls._create_key_pool(api_key)
+        cls._key_pool.create_clients()
+
+    @classmethod
+    def close_client(cls) -> None:
+        """
+        Closes the OpenAI clients of the key pool and releases their connection pools.
+        """
+        if cls._key_pool:
+            cls._key_pool.close()
+            cls._key_pool = None
 
     def complete_prompt(self, prompt: list[dict], output_format: Dict[str, Any], retries: int = 2,
-                        delay: float = 1.0) -> str:
+                        delay: float = 1.0, cancellation: Optional[CancellationToken] = None,
+                        budget: Optional[OutputBudget] = None, cache_key: Optional[str] = None) -> str:
         """
         Sends a prompt to the OpenAI API and retrieves a completion response.
 
@@ -59,29 +109,209 @@ class GPTService:
             output_format (Dict[str, Any]): The format of the expected response.
             retries (int, optional): Number of retry attempts in case of transient API errors. Default is 2.
             delay (float, optional): Delay in seconds between retries. Default is 1.0 Second.
+            cancellation (CancellationToken, optional): Aborts the request when the caller disconnects or the
+                deadline passes. The completion is then streamed so closing the stream stops the generation.
+            budget (OutputBudget, optional): Expected output of the request, limits the completion tokens and
+                the request time. The actual completion tokens are reported to the estimator, and a completion
+                cut off at the limit is retried once with a larger budget.
+            cache_key (str, optional): Key of the static prompt prefix, routes requests sharing the prefix to the
+                same prompt cache of the provider.
 
         Returns:
             str: The content of the first choice from the API response.
 
         Raises:
+            RequestCancelled: If the cancellation token was cancelled.
+            OutputTruncated: If the completion still stops at the limit of the larger budget.
+            OutputTimeout: If the completion is not finished within the timeout of the budget.
             Exception: If the maximum retries are exceeded or an unhandled error occurs.
         """
+        content, finish_reason = self._complete_with_retries(prompt, output_format, retries, delay, cancellation,
+                                                             budget, cache_key)
+        if budget and finish_reason == "length":
+            # The limit was chosen by the service, a cut-off completion is not the caller's fault
+            larger = get_output_estimator().enlarge(budget)
+            if larger is None:
+                raise OutputTruncated(budget.max_tokens)
+            self.logger.warning(f"Retrying truncated completion with {larger.max_tokens} max tokens")
+            content, finish_reason = self._complete_with_retries(prompt, output_format, retries, delay,
+                                                                 cancellation, larger, cache_key)
+            if finish_reason == "length":
+                raise OutputTruncated(larger.max_tokens)
+        return content
+
+    def _complete_with_retries(self, prompt: list[dict], output_format: Dict[str, Any], retries: int, delay: float,
+                               cancellation: Optional[CancellationToken], budget: Optional[OutputBudget],
+                               cache_key: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Requests one completion, retrying transient errors and moving to another key on key errors.
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: The content of the first choice and its finish reason.
+        """
+        from openai import (APIConnectionError, APITimeoutError, AuthenticationError, PermissionDeniedError,
+                            RateLimitError)
+
+        if budget:
+            estimated_tokens = budget.prompt_tokens + budget.expected_tokens
+            options = {"max_completion_tokens": budget.max_tokens}
+        else:
+            estimated_tokens = count_prompt_tokens(prompt) + self.COMPLETION_TOKENS_ESTIMATE
+            options = {}
+        if cache_key:
+            # Sent as a raw body field, the pinned openai release has no prompt_cache_key parameter
+            options["extra_body"] = {"prompt_cache_key": cache_key}
         for attempt in range(retries):
+            if cancellation:
+                cancellation.raise_if_cancelled()
+            key = self.key_pool.acquire(estimated_tokens, cancellation)
+            self.last_usage = None
+            started = time.perf_counter()
             try:
-                completion = self.client.chat.completions.create(
-                    model=self.DEFAULT_MODEL,
-                    temperature=self.DEFAULT_TEMPERATURE,
-                    top_p=self.DEFAULT_TOP_P,
-                    messages=prompt,
-                    response_format=output_format,
-                )
-                return completion.choices[0].message.content
+                if cancellation:
+                    content, finish_reason = self._stream_completion(key.client, prompt, output_format,
+                                                                     cancellation, budget, options)
+                else:
+                    client = key.client.with_options(timeout=budget.timeout) if budget else key.client
+                    completion = client.chat.completions.create(
+                        model=self.DEFAULT_MODEL,
+                        temperature=self.DEFAULT_TEMPERATURE,
+                        top_p=self.DEFAULT_TOP_P,
+                        messages=prompt,
+                        response_format=output_format,
+                        **options,
+                    )
+                    self.last_usage = completion.usage
+                    content, finish_reason = completion.choices[0].message.content, completion.choices[0].finish_reason
+
+                if self.last_usage:
+                    self._record_usage(self.last_usage)
+                    if self.captured is not None:
+                        self._capture(output_format, content, (time.perf_counter() - started) * 1000)
+                if budget and self.last_usage:
+                    get_output_estimator().observe(budget, self.last_usage.completion_tokens,
+                                                   finish_reason == "length")
+                return content, finish_reason
 
+            except (RequestCancelled, OutputTimeout):
+                raise
             except (APITimeoutError, APIConnectionError) as e:
+                if cancellation:
+                    cancellation.raise_if_cancelled()
                 self.logger.warning(f"Retrying due to transient error: {e} (attempt {attempt + 1})")
                 time.sleep(delay)
+            except (AuthenticationError, PermissionDeniedError, RateLimitError) as e:
+                # Rate limits only bench the key until its budget refills, auth and quota errors for longer
+                rate_limited = isinstance(e, RateLimitError) and "insufficient_quota" not in str(e)
+                self.key_pool.evict(key, e, seconds=delay if rate_limited else None)
+                if attempt + 1 < retries and self.key_pool.has_available_key():
+                    self.logger.warning(f"Retrying with another API key: {e} (attempt {attempt + 1})")
+                    continue
+                self._handle_api_error(e)
             except Exception as e:
                 self._handle_api_error(e)
+            finally:
+                usage = self.last_usage
+                self.key_pool.release(key, estimated_tokens, usage.total_tokens if usage else None)
+        return None, None
+
+    def _record_usage(self, usage) -> None:
+        """
+        Adds the usage of a completion to the totals of this instance and to the metrics, including the
+        prompt tokens served from the provider's prompt cache.
+        """
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+        with self._usage_lock:
+            self.usage_totals.update(prompt_tokens=usage.prompt_tokens, cached_tokens=cached_tokens,
+                                     completion_tokens=usage.completion_tokens)
+        metrics.increment("prompt_tokens_total", usage.prompt_tokens)
+        metrics.increment("prompt_cached_tokens_total", cached_tokens)
+        metrics.increment("completion_tokens_total", usage.completion_tokens)
+
+    def _capture(self, output_format: Dict[str, Any], content: Optional[str], latency_ms: float) -> None:
+        """
+        Adds the capture entry of a completion to the captured completions of this instance.
+        """
+        from app.services.traffic_capture import get_traffic_capture
+
+        capture = get_traffic_capture()
+        if capture:
+            self.captured.append(capture.completion_entry(output_format, content, self.last_usage, latency_ms))
+
+    def _stream_completion(self, client: "OpenAI", prompt: list[dict], output_format: Dict[str, Any],
+                           cancellation: CancellationToken, budget: Optional[OutputBudget],
+                           options: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        """
+        Streams a completion, checking the cancellation token between chunks. Cancelling the token closes
+        the stream, which aborts the HTTP request and stops the generation upstream. The timeout of the
+        budget bounds the whole completion: the client timeout only applies to each connect and read.
+
+        Returns:
+            Tuple[str, Optional[str]]: The concatenated content of the first choice and its finish reason.
+
+        Raises:
+            OutputTimeout: If the completion is not finished within the timeout of the budget.
+        """
+        started = time.monotonic()
+        timeouts = [timeout for timeout in (cancellation.remaining(), budget.timeout if budget else None)
+                    if timeout is not None]
+        if timeouts:
+            client = client.with_options(timeout=max(min(timeouts), 0.001))
+
+        stream = client.chat.completions.create(
+            model=self.DEFAULT_MODEL,
+            temperature=self.DEFAULT_TEMPERATURE,
+            top_p=self.DEFAULT_TOP_P,
+            messages=prompt,
+            response_format=output_format,
+            stream=True,
+            stream_options={"include_usage": True},
+            **options,
+        )
+        cancellation.add_callback(stream.close)
+        timed_out = threading.Event()
+        timer = None
+        if budget:
+            # Closes a stream that stalls between chunks once the budget's time is used up
+            timer = threading.Timer(max(budget.timeout - (time.monotonic() - started), 0),
+                                    lambda: (timed_out.set(), stream.close()))
+            timer.daemon = True
+            timer.start()
+        parts = []
+        finish_reason = None
+        try:
+            for chunk in stream:
+                cancellation.raise_if_cancelled()
+                if timed_out.is_set() or (budget and time.monotonic() - started > budget.timeout):
+                    raise OutputTimeout(budget.timeout)
+                if chunk.usage:
+                    self.last_usage = chunk.usage
+                if chunk.choices:
+                    finish_reason = getattr(chunk.choices[0], "finish_reason", None) or finish_reason
+                    if chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+        except RequestCancelled:
+            self.logger.warning(f"Aborted OpenAI request: {cancellation.reason}")
+            raise
+        except OutputTimeout:
+            self.logger.warning(f"Aborted OpenAI request after the output budget of {budget.timeout}s")
+            raise
+        except Exception:
+            # Closing the stream from the cancelling thread surfaces here as a connection error
+            if cancellation.cancelled:
+                self.logger.warning(f"Aborted OpenAI request: {cancellation.reason}")
+                raise RequestCancelled(cancellation.reason)
+            if timed_out.is_set():
+                self.logger.warning(f"Aborted OpenAI request after the output budget of {budget.timeout}s")
+                raise OutputTimeout(budget.timeout)
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+            cancellation.remove_callback(stream.close)
+            stream.close()
+        return "".join(parts), finish_reason
 
     def _handle_api_error(self, error: Exception):
         """
@@ -93,6 +323,9 @@ class GPTService:
         Raises:
             Exception: Re-raises the exception after logging the error details.
         """
+        from openai import (APIError, AuthenticationError, BadRequestError, ConflictError, InternalServerError,
+                            NotFoundError, PermissionDeniedError, RateLimitError, UnprocessableEntityError)
+
         error_map = {
             BadRequestError: "Invalid request",
             AuthenticationError: "Unauthorized",
@@ -1,5 +1,3 @@
-from jsonschema import validate
-from jsonschema.exceptions import ValidationError, SchemaError
 from app.utils.logger import get_logger
 from typing import Dict, Any
 
@@ -18,6 +16,13 @@ class JSONValidator:
         self.logger = get_logger("JSONValidator")
         self.logger.info("Initializing JSON Validator")
 
+    @staticmethod
+    def warm_up() -> None:
+        """
+        Imports jsonschema and its format checkers ahead of the first validation.
+        """
+        import jsonschema.validators  # noqa: F401
+
     def validate_structure(self) -> bool:
         """
         Validates the structure of the parsed JSON response against the output schema.
@@ -28,6 +33,9 @@ class JSONValidator:
         Raises:
             Exception: If the parsed response or schema is invalid, or an unexpected error occurs.
         """
+        from jsonschema import validate
+        from jsonschema.exceptions import ValidationError, SchemaError
+
         try:
             validate(instance=self.parsed_response, schema=self.output_schema)
             return True
@@ -0,0 +1,206 @@
+import json
+import math
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.utils.hashing import json_hash
+from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+from app.utils.tokens import count_prompt_tokens, count_tokens
+
+
+class OutputTruncated(Exception):
+    """
+    Raised when a completion still stops at max_tokens after it was retried with a larger budget.
+    """
+
+    def __init__(self, max_tokens: int):
+        super().__init__(f"Completion truncated at the output budget of {max_tokens} tokens")
+        self.max_tokens = max_tokens
+
+
+class OutputTimeout(Exception):
+    """
+    Raised when a completion is not finished within the timeout of its budget.
+    """
+
+    def __init__(self, timeout: float):
+        super().__init__(f"Completion not finished within the output budget of {timeout}s")
+        self.timeout = timeout
+
+
+@dataclass
+class OutputBudget:
+    """
+    Expected size and cost of one completion, and the limits derived from it.
+    """
+    schema_key: str
+    prompt_tokens: int
+    expected_tokens: int
+    max_tokens: int
+    timeout: float
+    cost: float
+
+
+class OutputEstimator:
+    """
+    Estimates the completion tokens of a request from the response schema and the input length:
+    the tokens of an empty instance of the schema (keys and punctuation) plus a share of the input
+    tokens for the extracted values. The estimate of each schema is calibrated with the actual
+    completion tokens of earlier requests.
+    """
+
+    # Bounds of the calibration factor, a few outliers must not make the budgets useless
+    MIN_CALIBRATION = 0.25
+    MAX_CALIBRATION = 4.0
+
+    def __init__(self, tokens_per_input_token: float, headroom: float, min_tokens: int, max_tokens: int,
+                 base_timeout: float, tokens_per_second: float, input_cost_per_million: float,
+                 output_cost_per_million: float):
+        """
+        Args:
+            tokens_per_input_token (float): Completion tokens expected per token of input text.
+            headroom (float): Factor between the expected tokens and the max_tokens sent to the model.
+            min_tokens (int): Lower bound of max_tokens.
+            max_tokens (int): Upper bound of max_tokens, the output limit of the model.
+            base_timeout (float): Seconds allowed for the request besides the generation.
+            tokens_per_second (float): Assumed generation speed, used to derive the timeout.
+            input_cost_per_million (float): Price of one million prompt tokens.
+            output_cost_per_million (float): Price of one million completion tokens.
+        """
+        self.tokens_per_input_token = tokens_per_input_token
+        self.headroom = headroom
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.base_timeout = base_timeout
+        self.tokens_per_second = tokens_per_second
+        self.input_cost_per_million = input_cost_per_million
+        self.output_cost_per_million = output_cost_per_million
+        self.logger = get_logger("OutputEstimator")
+
+        self._structure_tokens: Dict[str, int] = {}
+        self._calibration: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        metrics.register_gauge("output_estimate_calibration", lambda: dict(self._calibration))
+
+    def _skeleton(self, schema: Dict[str, Any], defs: Dict[str, Any], depth: int = 0) -> Any:
+        """
+        Builds an instance of the schema with empty values and one item per array.
+        """
+        ref = schema.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/$defs/"):
+            schema = defs.get(ref.split("/")[-1], {})
+        schema_type = schema.get("type")
+        types = [t for t in (schema_type if isinstance(schema_type, list) else [schema_type]) if t != "null"]
+        if depth > 10:
+            return None
+        if "properties" in schema or types == ["object"]:
+            return {key: self._skeleton(value, defs, depth + 1) for key, value in schema.get("properties", {}).items()}
+        if types == ["array"]:
+            return [self._skeleton(schema.get("items", {}), defs, depth + 1)]
+        return {"string": "", "integer": 0, "number": 0, "boolean": False}.get(types[0] if types else None)
+
+    def structure_tokens(self, response_format: Dict[str, Any]) -> int:
+        """
+        Returns the tokens of an empty instance of the response schema, cached per schema.
+        """
+        schema_key = json_hash(response_format)
+        tokens = self._structure_tokens.get(schema_key)
+        if tokens is None:
+            schema = response_format.get("json_schema", {}).get("schema", response_format)
+            skeleton = self._skeleton(schema, schema.get("$defs", {}))
+            tokens = count_tokens(json.dumps(skeleton, separators=(",", ":"), ensure_ascii=False))
+            self._structure_tokens[schema_key] = tokens
+        return tokens
+
+    def estimate(self, text: str, response_format: Dict[str, Any], prompt: Optional[List[dict]] = None) -> OutputBudget:
+        """
+        Estimates the completion of a request and derives max_tokens, the timeout and the cost.
+
+        Args:
+            text (str): The unstructured text to extract.
+            response_format (Dict[str, Any]): The response format of the request.
+            prompt (List[dict], optional): The full prompt, for the prompt tokens of the cost.
+
+        Returns:
+            OutputBudget: The estimate and the limits of the request.
+        """
+        schema_key = json_hash(response_format)[:16]
+        raw = self.structure_tokens(response_format) + self.tokens_per_input_token * count_tokens(text)
+        expected = math.ceil(raw * self._calibration.get(schema_key, 1.0))
+        max_tokens = min(self.max_tokens, max(self.min_tokens, math.ceil(expected * self.headroom)))
+        prompt_tokens = count_prompt_tokens(prompt) if prompt else count_tokens(text)
+        cost = (prompt_tokens * self.input_cost_per_million + expected * self.output_cost_per_million) / 1_000_000
+        timeout = self.base_timeout + max_tokens / self.tokens_per_second
+        return OutputBudget(schema_key=schema_key, prompt_tokens=prompt_tokens, expected_tokens=expected,
+                            max_tokens=max_tokens, timeout=round(timeout, 1), cost=round(cost, 6))
+
+    def enlarge(self, budget: OutputBudget) -> Optional[OutputBudget]:
+        """
+        Returns the budget for retrying a truncated completion, with twice the max_tokens and the timeout
+        to match, or None if the budget is already at the upper bound.
+        """
+        if budget.max_tokens >= self.max_tokens:
+            return None
+        max_tokens = min(self.max_tokens, budget.max_tokens * 2)
+        return replace(budget, max_tokens=max_tokens,
+                       timeout=round(self.base_timeout + max_tokens / self.tokens_per_second, 1))
+
+    def expected_seconds(self, text_bytes: Optional[int]) -> float:
+        """
+        Rough generation time of a request from the size of its uploaded text, used to order queued requests
+        before the text is parsed.
+        """
+        if not text_bytes:
+            return 0.0
+        # About four bytes per token
+        return text_bytes / 4 * self.tokens_per_input_token / self.tokens_per_second
+
+    def observe(self, budget: OutputBudget, actual_tokens: int, truncated: bool) -> None:
+        """
+        Logs the predicted and actual completion tokens and calibrates the estimate of the schema.
+
+        Args:
+            budget (OutputBudget): The budget the request was sent with.
+            actual_tokens (int): Completion tokens reported in the usage.
+            truncated (bool): Whether the completion stopped at max_tokens.
+        """
+        self.logger.info(f"Completion tokens predicted {budget.expected_tokens}, actual {actual_tokens} "
+                         f"(max {budget.max_tokens}, schema {budget.schema_key})")
+        metrics.increment("output_tokens_predicted_total", budget.expected_tokens)
+        metrics.increment("output_tokens_actual_total", actual_tokens)
+        if truncated:
+            metrics.increment("output_budget_truncated_total")
+            self.logger.warning(f"Completion truncated at {budget.max_tokens} tokens (schema {budget.schema_key})")
+        if budget.expected_tokens <= 0:
+            return
+        with self._lock:
+            current = self._calibration.get(budget.schema_key, 1.0)
+            if truncated:
+                # The true size is unknown, only that it exceeds max_tokens: raise the estimate by the headroom,
+                # otherwise every request of the schema keeps hitting the same limit
+                updated = current * self.headroom
+            else:
+                ratio = current * actual_tokens / budget.expected_tokens
+                updated = 0.8 * current + 0.2 * ratio
+            self._calibration[budget.schema_key] = round(min(self.MAX_CALIBRATION,
+                                                             max(self.MIN_CALIBRATION, updated)), 4)
+
+
+_output_estimator: Optional[OutputEstimator] = None
+
+
+def get_output_estimator() -> OutputEstimator:
+    """
+    Returns the shared output estimator, created from the settings on first use.
+    """
+    global _output_estimator
+    if _output_estimator is None:
+        _output_estimator = OutputEstimator(settings.output_tokens_per_input_token, settings.output_budget_headroom,
+                                            settings.output_budget_min_tokens, settings.output_budget_max_tokens,
+                                            settings.output_timeout_base, settings.output_tokens_per_second,
+                                            settings.llm_input_cost_per_million,
+                                            settings.llm_output_cost_per_million)
+    return _output_estimator
@@ -0,0 +1,179 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+from app.core.config import settings
+from app.services.prompt_generator import PromptGenerator
+from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+from app.utils.tokens import count_tokens
+
+# Runs of \xNN escapes that str(bytes) produces for non-ASCII characters
+_BYTE_ESCAPES = re.compile(r"(?:\\x[0-9a-fA-F]{2})+")
+_HORIZONTAL_SPACE = re.compile(r"[ \t\f\v]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def decode_bytes_repr(text: str) -> str:
+    """
+    Removes the b'...' wrapper and decodes the byte escapes of a str(bytes) representation.
+    """
+    if len(text) > 2 and text[:2] in ("b'", 'b"') and text[-1] == text[1]:
+        text = text[2:-1]
+
+    def decode(match: re.Match) -> str:
+        return bytes.fromhex(match.group(0).replace("\\x", "")).decode("utf-8", errors="replace")
+
+    return _BYTE_ESCAPES.sub(decode, text).replace("\\r", "").replace("\\\\", "\\")
+
+
+def rewrite_json_blocks(text: str, format_json: Callable[[Any], str], format_text: Callable[[str], str]) -> str:
+    """
+    Re-serializes every JSON object embedded in a text and formats the text around them.
+
+    Args:
+        text (str): Text with embedded JSON objects, e.g. one example.
+        format_json (Callable[[Any], str]): Serializes a decoded JSON object.
+        format_text (Callable[[str], str]): Formats a piece of text between JSON objects.
+
+    Returns:
+        str: The rewritten text.
+    """
+    decoder = json.JSONDecoder()
+    parts = []
+    position = 0
+    while True:
+        start = text.find("{", position)
+        if start == -1:
+            break
+        try:
+            data, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            # A brace inside the text, not a JSON block
+            parts.append(format_text(text[position:start + 1]))
+            position = start + 1
+            continue
+        parts.append(format_text(text[position:start]))
+        parts.append(format_json(data))
+        position = end
+    parts.append(format_text(text[position:]))
+    return "".join(parts)
+
+
+class PromptCompactor:
+    """
+    Shrinks the few-shot examples before they are sent to the LLM: JSON blocks are minified,
+    null fields dropped, whitespace normalized and the escapes left by str(bytes) decoded.
+    The extracted content of the examples is unchanged.
+    """
+
+    def __init__(self, drop_nulls: bool = True):
+        """
+        Args:
+            drop_nulls (bool): Drop null fields from example outputs. The strict response format already
+                forces every key into the output, so the model does not need to see them.
+        """
+        self.drop_nulls = drop_nulls
+        self.logger = get_logger("PromptCompactor")
+
+    def compact_examples(self, examples: str) -> str:
+        """
+        Compacts the examples as parsed by InputFileParser.parse_examples.
+
+        Args:
+            examples (str): The examples separated by the examples separator.
+
+        Returns:
+            str: The compacted examples.
+        """
+        examples = decode_bytes_repr(examples)
+        separator = settings.examples_separator
+        compacted = [self._compact_example(example) for example in examples.split(separator)]
+        return f"\n{separator}\n".join(example for example in compacted if example)
+
+    def _compact_example(self, example: str) -> str:
+        """
+        Minifies every JSON object of an example and normalizes the whitespace of the text around it.
+        """
+        return rewrite_json_blocks(
+            example, lambda data: json.dumps(self._drop_nulls(data), separators=(",", ":"), ensure_ascii=False),
+            self._normalize_text).strip()
+
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        lines = [_HORIZONTAL_SPACE.sub(" ", line).strip() for line in text.replace("\r\n", "\n").split("\n")]
+        return _BLANK_LINES.sub("\n\n", "\n".join(lines))
+
+    def _drop_nulls(self, data: Any) -> Any:
+        if not self.drop_nulls:
+            return data
+        if isinstance(data, dict):
+            return {key: self._drop_nulls(value) for key, value in data.items() if value is not None}
+        if isinstance(data, list):
+            return [self._drop_nulls(item) for item in data]
+        return data
+
+
+class CompactionCache:
+    """
+    Compacts the examples of each profile once and records the prompt tokens saved per profile.
+    """
+
+    def __init__(self, max_profiles: int = 128):
+        self.max_profiles = max_profiles
+        self._cache: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._compactor = PromptCompactor(drop_nulls=settings.compaction_drop_nulls)
+
+    def get(self, profile: str, examples: str) -> Tuple[str, int]:
+        """
+        Args:
+            profile (str): Profile hash of the request.
+            examples (str): The examples as parsed by InputFileParser.
+
+        Returns:
+            Tuple[str, int]: The compacted examples and the prompt tokens saved per request, including
+            the shorter system prompt.
+        """
+        with self._lock:
+            if profile in self._cache:
+                self._cache.move_to_end(profile)
+                return self._cache[profile]
+
+        compacted = self._compactor.compact_examples(examples)
+        saved = (count_tokens(examples) - count_tokens(compacted)
+                 + count_tokens(PromptGenerator.SYSTEM_PROMPT) - count_tokens(PromptGenerator.COMPACT_SYSTEM_PROMPT))
+        self._compactor.logger.info(f"Compacted examples of profile {profile[:12]}: {saved} tokens saved per request")
+
+        with self._lock:
+            self._cache[profile] = (compacted, saved)
+            while len(self._cache) > self.max_profiles:
+                self._cache.popitem(last=False)
+        return compacted, saved
+
+    def savings(self) -> Dict[str, int]:
+        """
+        Returns the prompt tokens saved per request for each cached profile.
+        """
+        with self._lock:
+            return {profile[:12]: saved for profile, (_, saved) in self._cache.items()}
+
+
+_compaction_cache = None
+_compaction_cache_lock = threading.Lock()
+
+
+def compact_examples_for_profile(profile: str, examples: str) -> Tuple[str, int]:
+    """
+    Returns the compacted examples of a profile and counts the saved tokens in the metrics.
+    """
+    global _compaction_cache
+    with _compaction_cache_lock:
+        if _compaction_cache is None:
+            _compaction_cache = CompactionCache()
+            metrics.register_gauge("prompt_tokens_saved_per_request", _compaction_cache.savings)
+    compacted, saved = _compaction_cache.get(profile, examples)
+    metrics.increment("prompt_tokens_saved_total", saved, profile=profile[:12])
+    return compacted, saved
@@ -1,5 +1,5 @@
 from app.utils.logger import get_logger
-from typing import List
+from typing import List, Optional
 
 
 class PromptGenerator:
@@ -7,14 +7,47 @@ class PromptGenerator:
     Service class to generate structured prompts for the LLM API based on the input recipe and JSON schema.
     """
 
-    def __init__(self, unstructured_text: str, examples: str):
+    SYSTEM_PROMPT = ("You are a data extraction assistant specializing in transforming unstructured text into "
+                     "structured JSON formats. Your task is to extract information from the provided text and "
+                     "organize it into a structured JSON format following the provided JSON schema. Ensure all "
+                     "extracted information matches the structure and data types defined in the schema.\n\n"
+                     ""
+                     "Before extracting information, apply named entity recognition to identify relevant "
+                     "entities and relationship extraction techniques to map connections between entities. Use "
+                     "these insights to populate the JSON schema fields accurately.\n\n"
+                     ""
+                     "If a value for any key in the schema is not present in the text or cannot be confidently "
+                     "inferred, return null for that key."
+                     "\n\n"
+                     ""
+                     "Input: \n"
+                     "- Text: A block of unstructured text.\n"
+                     "- Schema: A JSON schema defining the expected keys and data types.\n\n"
+                     ""
+                     "Output: \n"
+                     "- A JSON object populated with data extracted from the text.\n\n"
+                     "")
+
+    # Same instructions in fewer tokens, used together with compacted examples
+    COMPACT_SYSTEM_PROMPT = ("Extract information from the user's unstructured text into JSON following the provided "
+                             "schema, matching its structure and data types. Identify the relevant entities and their "
+                             "relationships first. Use null for any key whose value is not in the text or cannot be "
+                             "confidently inferred.")
+
+    def __init__(self, unstructured_text: str, examples: str, compact: bool = False, profile: Optional[str] = None):
         """
         Args:
             examples (str): the examples of the structured JSON output
             unstructured_text (str): the input unstructured text to convert
+            compact (bool): use the shorter system prompt
+            profile (str, optional): profile hash of the request, the system prompt and canonical examples
+                are then taken from the prefix cache of the profile
         """
         self.unstructured_text = unstructured_text
         self.examples = examples
+        self.compact = compact
+        self.profile = profile
+        self.cache_key = None
         self.logger = get_logger("PromptGenerator")
         self.logger.info("Initialized PromptGenerator")
 
@@ -27,29 +60,19 @@ class PromptGenerator:
         Returns:
             str: A structured prompt to send to the LLM API.
         """
+        if self.profile:
+            # Imported lazily, the prefix cache builds on this module
+            from app.services.prompt_prefix import get_prompt_prefix
+
+            prefix = get_prompt_prefix(self.profile, self.examples, self.compact)
+            self.cache_key = prefix.cache_key
+            self.logger.info("Generated prompt for LLM API from the cached prefix.")
+            return [*prefix.messages, {"role": "user", "content": f"{self.unstructured_text}"}]
+
         prompt = [
             {
                 "role": "system",
-                "content": "You are a data extraction assistant specializing in transforming unstructured text into "
-                           "structured JSON formats. Your task is to extract information from the provided text and "
-                           "organize it into a structured JSON format following the provided JSON schema. Ensure all "
-                           "extracted information matches the structure and data types defined in the schema.\n\n"
-                           ""
-                           "Before extracting information, apply named entity recognition to identify relevant "
-                           "entities and relationship extraction techniques to map connections between entities. Use "
-                           "these insights to populate the JSON schema fields accurately.\n\n"
-                           ""
-                           "If a value for any key in the schema is not present in the text or cannot be confidently "
-                           "inferred, return null for that key."
-                           "\n\n"
-                           ""
-                           "Input: \n"
-                           "- Text: A block of unstructured text.\n"
-                           "- Schema: A JSON schema defining the expected keys and data types.\n\n"
-                           ""
-                           "Output: \n"
-                           "- A JSON object populated with data extracted from the text.\n\n"
-                           ""
+                "content": self.COMPACT_SYSTEM_PROMPT if self.compact else self.SYSTEM_PROMPT
             },
             {
                 "role": "assistant",
@@ -0,0 +1,108 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+from app.core.config import settings
+from app.services.prompt_compactor import decode_bytes_repr, rewrite_json_blocks
+from app.services.prompt_generator import PromptGenerator
+from app.utils.hashing import content_hash
+from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+
+_TRAILING_SPACE = re.compile(r"[ \t\f\v]+\n")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """
+    The static start of the prompts of a profile: the system prompt and the examples.
+    """
+    messages: Tuple[Dict[str, str], ...]
+    cache_key: str
+
+
+def canonicalize_examples(examples: str) -> str:
+    """
+    Brings the examples into a canonical form that does not depend on how the file was uploaded: the
+    str(bytes) escapes are decoded, line endings and trailing whitespace normalized and the JSON blocks
+    re-serialized on a single line. The extracted content of the examples is unchanged.
+
+    Args:
+        examples (str): The examples as parsed by InputFileParser.parse_examples.
+
+    Returns:
+        str: The canonical examples.
+    """
+    def format_text(text: str) -> str:
+        text = _TRAILING_SPACE.sub("\n", text.replace("\r\n", "\n"))
+        return _BLANK_LINES.sub("\n\n", text)
+
+    separator = settings.examples_separator
+    canonical = [rewrite_json_blocks(example, lambda data: json.dumps(data, ensure_ascii=False),
+                                     format_text).strip()
+                 for example in decode_bytes_repr(examples).split(separator)]
+    return f"\n{separator}\n".join(example for example in canonical if example)
+
+
+class PromptPrefixCache:
+    """
+    Builds the prompt prefix of each profile once and hands out the same messages on every request, so
+    the prefix is byte-identical across requests and the provider's prompt cache can reuse it. Profiles
+    with the same canonical examples share a cache key.
+    """
+
+    def __init__(self, max_profiles: int = 128):
+        self.max_profiles = max_profiles
+        self.logger = get_logger("PromptPrefixCache")
+        self._cache: "OrderedDict[Tuple[str, bool], PromptPrefix]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, profile: str, examples: str, compact: bool) -> PromptPrefix:
+        """
+        Args:
+            profile (str): Profile hash of the request.
+            examples (str): The examples of the request, compacted if compact is set.
+            compact (bool): Whether the compact system prompt and examples are used.
+
+        Returns:
+            PromptPrefix: The prefix messages and their cache key.
+        """
+        key = (profile, compact)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        # Compacted examples are already canonical
+        content = examples if compact else canonicalize_examples(examples)
+        system_prompt = PromptGenerator.COMPACT_SYSTEM_PROMPT if compact else PromptGenerator.SYSTEM_PROMPT
+        messages = ({"role": "system", "content": system_prompt}, {"role": "assistant", "content": content})
+        prefix = PromptPrefix(messages, content_hash(system_prompt + "\0" + content)[:32])
+        self.logger.info(f"Built prompt prefix {prefix.cache_key[:12]} of profile {profile[:12]}")
+
+        with self._lock:
+            self._cache[key] = prefix
+            while len(self._cache) > self.max_profiles:
+                self._cache.popitem(last=False)
+        return prefix
+
+
+_prefix_cache = None
+_prefix_cache_lock = threading.Lock()
+
+
+def get_prompt_prefix(profile: str, examples: str, compact: bool) -> PromptPrefix:
+    """
+    Returns the cached prompt prefix of a profile.
+    """
+    global _prefix_cache
+    with _prefix_cache_lock:
+        if _prefix_cache is None:
+            _prefix_cache = PromptPrefixCache()
+            metrics.register_gauge("prompt_prefix_profiles", lambda: len(_prefix_cache._cache))
+    return _prefix_cache.get(profile, examples, compact)
+
@@ -0,0 +1,195 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.logger import get_logger
+
+# Indexed fields are interpolated into SQL, only plain dotted JSON paths are accepted
+_FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+
+class ResultsStore:
+    """
+    SQLite store of validated extraction results. Each result is kept with the hash of its input text,
+    its profile and the model, and is indexed by document hash and a configurable set of extracted
+    fields through JSON1 expression indexes.
+    """
+
+    def __init__(self, path: str, index_fields: List[str]):
+        """
+        Args:
+            path (str): Path of the SQLite database file.
+            index_fields (List[str]): Dotted JSON paths of extracted fields to index, e.g. "Recipe.title".
+        """
+        self.logger = get_logger("ResultsStore")
+        invalid = [name for name in index_fields if not _FIELD_PATTERN.match(name)]
+        if invalid:
+            raise ValueError(f"Invalid indexed result fields: {invalid}")
+        self.index_fields = index_fields
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._create_schema()
+
+    @staticmethod
+    def _json_path(field: str) -> str:
+        return "$." + field
+
+    def _create_schema(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "document_hash TEXT NOT NULL, "
+                "profile TEXT NOT NULL, "
+                "model TEXT NOT NULL, "
+                "created_at TEXT NOT NULL, "
+                "result TEXT NOT NULL CHECK (json_valid(result)))"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_results_document ON results (document_hash, profile, id)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_results_profile ON results (profile, id)")
+            for field in self.index_fields:
+                index_name = "idx_results_field_" + field.replace(".", "_")
+                self._connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {index_name} "
+                    f"ON results (json_extract(result, '{self._json_path(field)}'), id)")
+
+    def add(self, document_hash: str, profile: str, model: str, result: Dict[str, Any]) -> int:
+        """
+        Persists a validated result.
+
+        Args:
+            document_hash (str): Hash of the input text.
+            profile (str): Profile hash of the examples and schema.
+            model (str): The model that produced the result.
+            result (Dict[str, Any]): The validated structured output.
+
+        Returns:
+            int: The id of the stored result.
+        """
+        created_at = datetime.now(timezone.utc).isoformat()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO results (document_hash, profile, model, created_at, result) VALUES (?, ?, ?, ?, ?)",
+                (document_hash, profile, model, created_at, json.dumps(result, ensure_ascii=False)))
+            return cursor.lastrowid
+
+    def get(self, result_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Returns a stored result by id, or None.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM results WHERE id = ?", (result_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def query(self, document_hash: Optional[str] = None, profile: Optional[str] = None,
+              field: Optional[str] = None, value: Optional[str] = None, limit: int = 50,
+              cursor: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Finds stored results, newest first, with keyset pagination.
+
+        Args:
+            document_hash (str, optional): Only results of this input text.
+            profile (str, optional): Only results of this profile.
+            field (str, optional): An indexed field to filter on, requires value.
+            value (str, optional): The value the field must equal, numbers and booleans match as text or JSON.
+            limit (int): Maximum number of results per page.
+            cursor (int, optional): The next_cursor of the previous page.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Optional[int]]: The page and the cursor of the next page, if any.
+
+        Raises:
+            ValueError: If the field is not indexed.
+        """
+        conditions, parameters = [], []
+        if document_hash:
+            conditions.append("document_hash = ?")
+            parameters.append(document_hash)
+        if profile:
+            conditions.append("profile = ?")
+            parameters.append(profile)
+        if field is not None:
+            if field not in self.index_fields:
+                raise ValueError(f"Field {field} is not indexed, indexed fields: {', '.join(self.index_fields)}")
+            # The literal path matches the expression index
+            candidates = self._field_values(value)
+            conditions.append(f"json_extract(result, '{self._json_path(field)}') "
+                              f"IN ({', '.join('?' * len(candidates))})")
+            parameters.extend(candidates)
+        if cursor is not None:
+            conditions.append("id < ?")
+            parameters.append(cursor)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._connection.execute(f"SELECT * FROM results {where} ORDER BY id DESC LIMIT ?",
+                                            (*parameters, limit + 1)).fetchall()
+        items = [self._to_dict(row) for row in rows[:limit]]
+        next_cursor = items[-1]["id"] if len(rows) > limit else None
+        return items, next_cursor
+
+    @staticmethod
+    def _field_values(value: str) -> List[Any]:
+        """
+        Returns the SQL values a query value matches. json_extract returns numbers and booleans (as 1 and 0)
+        with their SQL type, so a value that parses as a JSON number or boolean also matches those.
+        """
+        candidates: List[Any] = [value]
+        try:
+            parsed = json.loads(value)
+        except json.JSONDecodeError:
+            return candidates
+        if isinstance(parsed, (bool, int, float)):
+            candidates.append(int(parsed) if isinstance(parsed, bool) else parsed)
+        return candidates
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        item = dict(row)
+        item["result"] = json.loads(item["result"])
+        return item
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+_results_store: Optional[ResultsStore] = None
+_results_store_lock = threading.Lock()
+
+
+def get_results_store() -> Optional[ResultsStore]:
+    """
+    Returns the shared results store, or None if RESULTS_DB_PATH is not configured.
+    """
+    global _results_store
+    if not settings.results_db_path:
+        return None
+    with _results_store_lock:
+        if _results_store is None:
+            fields = [name.strip() for name in settings.results_index_fields.split(",") if name.strip()]
+            _results_store = ResultsStore(settings.results_db_path, fields)
+        return _results_store
+
+
+def close_results_store() -> None:
+    """
+    Closes the shared results store, called on shutdown.
+    """
+    global _results_store
+    with _results_store_lock:
+        if _results_store is not None:
+            _results_store.close()
+            _results_store = None
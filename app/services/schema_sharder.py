@@ -0,0 +1,188 @@
+import copy
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.utils.cancellation import CancellationToken
+from app.utils.logger import get_logger
+
+# Arrays are expected to produce several items, weight them higher when balancing shards
+ARRAY_WEIGHT = 5
+
+
+class SchemaSharder:
+    """
+    Splits a wide response format into sub-schemas over disjoint sets of top-level properties, so the
+    shards can be extracted concurrently as shorter completions and merged afterwards.
+
+    A root holding a single object property (e.g. {"Recipe": {...}}) is treated as a wrapper and its
+    properties are sharded instead, each shard keeping the wrapper.
+    """
+
+    def __init__(self, response_format: Dict[str, Any], max_shards: int):
+        """
+        Args:
+            response_format (Dict[str, Any]): The response format produced by ResponseSchemaGenerator.
+            max_shards (int): Maximum number of shards.
+        """
+        self.response_format = response_format
+        self.max_shards = max_shards
+        self.logger = get_logger("SchemaSharder")
+
+        # Formats without a JSON schema (e.g. json_object) have no properties to shard
+        self.schema = (response_format.get("json_schema") or {}).get("schema") or {}
+        self.defs = self.schema.get("$defs", {})
+
+    def _resolve(self, schema: Dict[str, Any]) -> Dict[str, Any]:
+        ref = schema.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/$defs/"):
+            return self._resolve(self.defs.get(ref.split("/")[-1], {}))
+        return schema
+
+    def _find_shardable(self) -> Tuple[List[str], Dict[str, Any]]:
+        """
+        Descends through single-property object wrappers.
+
+        Returns:
+            Tuple[List[str], Dict[str, Any]]: The wrapper path and the object schema whose properties are sharded.
+        """
+        path = []
+        node = self.schema
+        while True:
+            properties = node.get("properties", {})
+            if len(properties) != 1:
+                return path, node
+            key, child = next(iter(properties.items()))
+            child = self._resolve(child)
+            if child.get("type") not in ("object", ["object", "null"]) or "properties" not in child:
+                return path, node
+            path.append(key)
+            node = child
+
+    def _weight(self, schema: Dict[str, Any], depth: int = 0) -> int:
+        schema = self._resolve(schema)
+        if depth > 10:
+            return 1
+        if "properties" in schema:
+            return sum(self._weight(value, depth + 1) for value in schema["properties"].values()) or 1
+        if "items" in schema:
+            return ARRAY_WEIGHT * self._weight(schema["items"], depth + 1)
+        return 1
+
+    def split(self) -> List[Dict[str, Any]]:
+        """
+        Balances the properties over at most max_shards shards by their expected output size.
+
+        Returns:
+            List[Dict[str, Any]]: One response format per shard. A single entry means the schema is not worth sharding.
+        """
+        path, node = self._find_shardable()
+        properties = node.get("properties", {})
+        shard_count = min(self.max_shards, len(properties))
+        if shard_count < 2:
+            return [self.response_format]
+
+        bins: List[List[str]] = [[] for _ in range(shard_count)]
+        loads = [0] * shard_count
+        for key in sorted(properties, key=lambda name: self._weight(properties[name]), reverse=True):
+            lightest = loads.index(min(loads))
+            bins[lightest].append(key)
+            loads[lightest] += self._weight(properties[key])
+
+        shards = []
+        for index, keys in enumerate(bins):
+            shard_schema = copy.deepcopy(self.schema)
+            shard_node = shard_schema
+            for key in path:
+                shard_node = shard_node["properties"][key]
+            # Keep the original property order
+            ordered = [key for key in properties if key in keys]
+            shard_node["properties"] = {key: shard_node["properties"][key] for key in ordered}
+            shard_node["required"] = [key for key in node.get("required", ordered) if key in keys]
+
+            shard_format = copy.deepcopy(self.response_format)
+            shard_format["json_schema"]["name"] = f"{self.response_format['json_schema'].get('name', 'Schema')}_{index}"
+            shard_format["json_schema"]["schema"] = shard_schema
+            shards.append(shard_format)
+
+        self.logger.info(f"Split schema into {len(shards)} shards: {bins}")
+        return shards
+
+    def restore_order(self, result: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Puts the sharded properties of a merged output back into the order of the schema.
+        """
+        path, node = self._find_shardable()
+        target = result
+        for key in path:
+            if not isinstance(target, dict) or not isinstance(target.get(key), dict):
+                return result
+            target = target[key]
+        if isinstance(target, dict):
+            ordered = {key: target[key] for key in node.get("properties", {}) if key in target}
+            ordered.update({key: value for key, value in target.items() if key not in ordered})
+            target.clear()
+            target.update(ordered)
+        return result
+
+
+def merge_shards(results: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    Deep-merges the outputs of the shards. Shards cover disjoint properties, so objects are merged
+    key by key and the first non-null value wins.
+    """
+    def merge(base: Any, update: Any) -> Any:
+        if isinstance(base, dict) and isinstance(update, dict):
+            merged = dict(base)
+            for key, value in update.items():
+                merged[key] = merge(base.get(key), value)
+            return merged
+        return update if base is None else base
+
+    merged = None
+    for result in results:
+        merged = merge(merged, result)
+    return merged
+
+
+def extract_sharded(extract: Callable[[Dict[str, Any], CancellationToken], Optional[Dict[str, Any]]],
+                    response_format: Dict[str, Any], max_shards: int,
+                    cancellation: CancellationToken) -> Optional[Dict[str, Any]]:
+    """
+    Extracts every shard of the response format concurrently and merges the outputs. When a shard
+    fails, the other shards are cancelled and the error of the failed shard is raised.
+
+    Args:
+        extract (Callable[[Dict[str, Any], CancellationToken], Optional[Dict[str, Any]]]): Extracts the text
+            with a given response format, aborting when the given token is cancelled.
+        response_format (Dict[str, Any]): The full response format.
+        max_shards (int): Maximum number of concurrent shards.
+        cancellation (CancellationToken): Cancellation of the request.
+
+    Returns:
+        Optional[Dict[str, Any]]: The merged output.
+    """
+    sharder = SchemaSharder(response_format, max_shards)
+    shards = sharder.split()
+    if len(shards) == 1:
+        return extract(shards[0], cancellation)
+
+    # Cancelled with the request, or by the first failing shard without cancelling the request itself
+    shard_cancellation = CancellationToken(cancellation.deadline)
+    def forward() -> None:
+        shard_cancellation.cancel(cancellation.reason)
+
+    cancellation.add_callback(forward)
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard") as executor:
+            futures = [executor.submit(extract, shard, shard_cancellation) for shard in shards]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = next((future for future in futures if future in done and future.exception()), None)
+            if failed:
+                shard_cancellation.cancel("shard_failed")
+                for future in futures:
+                    future.cancel()
+                raise failed.exception()
+            results = [future.result() for future in futures]
+    finally:
+        cancellation.remove_callback(forward)
+    return sharder.restore_order(merge_shards(results))
@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.hashing import content_hash
+from app.utils.logger import get_logger
+
+
+
+def mask_values(data: Any) -> Any:
+    """
+    Replaces every string of a JSON value with a filler of the same length, keeping the structure and size.
+    """
+    if isinstance(data, dict):
+        return {key: mask_values(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [mask_values(item) for item in data]
+    if isinstance(data, str):
+        return "x" * len(data)
+    return data
+
+
+def usage_dict(usage: Any) -> Dict[str, int]:
+    """
+    Returns the prompt, cached and completion tokens of an OpenAI usage object.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens,
+            "cached_tokens": getattr(details, "cached_tokens", 0) or 0}
+
+
+def completion_object(content: str, usage: Dict[str, int], finish_reason: str = "stop") -> SimpleNamespace:
+    """
+    Builds an object shaped like an OpenAI chat completion.
+    """
+    details = SimpleNamespace(cached_tokens=usage.get("cached_tokens", 0))
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)],
+        usage=SimpleNamespace(prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"],
+                              total_tokens=usage["prompt_tokens"] + usage["completion_tokens"],
+                              prompt_tokens_details=details),
+    )
+
+
+class CompletionStream(list):
+    """
+    Stream chunks shaped like those of an OpenAI streamed chat completion: the content, then the usage.
+    """
+
+    def __init__(self, completion: SimpleNamespace):
+        choice = completion.choices[0]
+        delta = SimpleNamespace(content=choice.message.content)
+        super().__init__([SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=choice.finish_reason)],
+                                          usage=None),
+                          SimpleNamespace(choices=[], usage=completion.usage)])
+
+    def close(self) -> None:
+        pass
+
+
+class TrafficCapture:
+    """
+    Records the traffic of the service for replay: one JSONL line per request with its arrival offset,
+    upload sizes, profile, options, status, latency and the completions returned by GPTService. Texts
+    are not recorded. Unless masking is disabled, the string values of the completions are masked and
+    the examples and schemas of each profile are recorded as hashes and sizes only; without masking
+    they are recorded once per profile, so the requests can be rebuilt from the capture alone.
+    """
+
+    def __init__(self, path: str, mask: bool = True):
+        """
+        Args:
+            path (str): JSONL file the capture is appended to.
+            mask (bool): Replace the string values of the completions with fillers of the same length and
+                record the profile files as hashes.
+        """
+        self.path = path
+        self.mask = mask
+        self.logger = get_logger("TrafficCapture")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._started = time.monotonic()
+        self._next_id = 0
+        self._profiles = set()
+        self._lock = threading.Lock()
+
+    def new_record(self) -> Dict[str, Any]:
+        """
+        Starts the record of an arriving request.
+        """
+        with self._lock:
+            record_id = self._next_id
+            self._next_id += 1
+        return {"type": "request", "id": record_id, "offset": round(time.monotonic() - self._started, 4),
+                "completions": []}
+
+    def completion_entry(self, response_format: Dict[str, Any], content: Optional[str], usage: Any,
+                         latency_ms: float) -> Dict[str, Any]:
+        """
+        Builds the capture entry of one completion.
+        """
+        if self.mask and content:
+            try:
+                content = json.dumps(mask_values(json.loads(content)), ensure_ascii=False)
+            except json.JSONDecodeError:
+                content = "x" * len(content)
+        return {"schema": response_format.get("json_schema", {}).get("name"), "completion": content,
+                "usage": usage_dict(usage), "latency_ms": round(latency_ms, 2)}
+
+    def add_profile(self, profile: str, examples: bytes, json_schema: bytes, validation_schema: bytes) -> None:
+        """
+        Records the files of a profile the first time it is seen. When masking, only their hashes and
+        sizes are recorded; the replay is given the files separately and matches them by hash.
+        """
+        with self._lock:
+            if profile in self._profiles:
+                return
+            self._profiles.add(profile)
+        files = {"examples": examples, "json": json_schema, "validation": validation_schema}
+        if self.mask:
+            record = {"files": {name: {"sha256": content_hash(data), "size": len(data)}
+                                for name, data in files.items()}}
+        else:
+            record = {name: data.decode("utf-8", errors="replace") for name, data in files.items()}
+        self._write({"type": "profile", "profile": profile, **record})
+
+    def write_request(self, record: Dict[str, Any]) -> None:
+        self._write(record)
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a") as file:
+            file.write(line)
+
+
+_traffic_capture: Optional[TrafficCapture] = None
+_traffic_capture_lock = threading.Lock()
+
+
+def get_traffic_capture() -> Optional[TrafficCapture]:
+    """
+    Returns the shared traffic capture, or None if CAPTURE_PATH is not configured.
+    """
+    global _traffic_capture
+    if not settings.capture_path:
+        return None
+    with _traffic_capture_lock:
+        if _traffic_capture is None:
+            _traffic_capture = TrafficCapture(settings.capture_path, settings.capture_mask_values)
+        return _traffic_capture
+
+
+class TrafficCaptureMiddleware:
+    """
+    ASGI middleware that completes the capture record of a request with its status and latency and writes it.
+    Only the send channel is wrapped, the receive channel the disconnect detection polls is passed through.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Set on request.state by the endpoint when the request is captured
+            record = scope.get("state", {}).get("capture")
+            capture = get_traffic_capture()
+            if record is not None and capture:
+                record["status"] = status["code"]
+                record["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                capture.write_request(record)
+
+
+def load_capture(path: str) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Reads a capture file.
+
+    Returns:
+        Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]: The profiles by hash and the requests in arrival order.
+    """
+    profiles, requests = {}, []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["type"] == "profile":
+                profiles[record["profile"]] = record
+            else:
+                requests.append(record)
+    requests.sort(key=lambda record: record["offset"])
+    return profiles, requests
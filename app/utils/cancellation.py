@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class RequestCancelled(Exception):
+    """
+    Raised inside the pipeline when the caller disconnected or the request deadline passed.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request cancelled: {reason}")
+        self.reason = reason
+
+
+class CancellationToken:
+    """
+    Shared between the request handler and the pipeline threads of one request. The handler cancels it
+    when the client disconnects or the deadline passes; the pipeline checks it between stages and
+    registered callbacks abort in-flight LLM requests.
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        """
+        Args:
+            deadline (float, optional): time.monotonic() value after which the request is cancelled.
+        """
+        self.deadline = deadline
+        self.reason: Optional[str] = None
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def remaining(self) -> Optional[float]:
+        """
+        Returns:
+            Optional[float]: Seconds until the deadline, or None without a deadline.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def cancel(self, reason: str) -> None:
+        """
+        Cancels the request once and runs the registered callbacks.
+        """
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # Aborting an in-flight request may fail if it finished meanwhile
+                pass
+
+    def check_deadline(self) -> None:
+        """
+        Cancels the request if its deadline has passed.
+        """
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            self.cancel("deadline_exceeded")
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Raises:
+            RequestCancelled: If the request was cancelled or its deadline has passed.
+        """
+        self.check_deadline()
+        if self.reason is not None:
+            raise RequestCancelled(self.reason)
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """
+        Registers a callback run on cancellation, runs it right away if already cancelled.
+        """
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
@@ -0,0 +1,25 @@
+import hashlib
+import json
+from typing import Any, Union
+
+
+def content_hash(text: Union[str, bytes]) -> str:
+    """
+    Returns the SHA-256 hex digest of a text or of raw bytes.
+    """
+    return hashlib.sha256(text.encode("utf-8") if isinstance(text, str) else text).hexdigest()
+
+
+def json_hash(data: Any) -> str:
+    """
+    Returns the SHA-256 hex digest of the canonical (sorted, compact) JSON form of the data.
+    """
+    return content_hash(json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False))
+
+
+def profile_hash(examples: str, output_schema: Any) -> str:
+    """
+    Identifies an extraction profile, i.e. the examples and the response schema a text is extracted with.
+    Results are only comparable between requests with the same profile hash.
+    """
+    return content_hash(f"{content_hash(examples)}:{json_hash(output_schema)}")
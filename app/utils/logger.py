@@ -39,6 +39,10 @@ def get_logger(logger_name: str) -> logging.Logger:
     log_format = "[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s"
     date_format = "%Y-%m-%d %H:%M:%S"
 
+    # Handlers are only attached once, loggers are fetched again by every service instance
+    if logger.handlers:
+        return logger
+
     # Loggen in Datei
     log_file_path = "logs/app.log"
     os.makedirs(os.path.dirname(log_file_path), exist_ok=True)  # Ensure log directory exists
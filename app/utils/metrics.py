@@ -0,0 +1,57 @@
+import threading
+from typing import Any, Callable, Dict
+
+
+def _key(name: str, labels: Dict[str, Any]) -> str:
+    if not labels:
+        return name
+    label_text = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{label_text}}}"
+
+
+class MetricsRegistry:
+    """
+    In-process counters and gauges exposed on the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        """
+        Adds a value to a counter.
+
+        Args:
+            name (str): The counter name.
+            value (float): The amount to add. Default is 1.
+            **labels: Optional labels distinguishing series of the same counter.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register_gauge(self, name: str, read: Callable[[], Any]) -> None:
+        """
+        Registers a gauge whose value is read when the metrics are collected.
+
+        Args:
+            name (str): The gauge name.
+            read (Callable[[], Any]): Returns the current value, or a dict of labelled values.
+        """
+        with self._lock:
+            self._gauges[name] = read
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: The current counters and gauges.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        return {"counters": counters, "gauges": {name: read() for name, read in gauges.items()}}
+
+
+metrics = MetricsRegistry()
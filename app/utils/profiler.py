@@ -0,0 +1,161 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.config import settings
+
+
+class NullProfiler:
+    """
+    Profiler used when profiling is disabled. Every call is a no-op.
+    """
+
+    enabled = False
+    profile_id = None
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+class RequestProfiler:
+    """
+    Collects wall-clock timings per pipeline stage and a cProfile profile for a single request.
+    """
+
+    enabled = True
+
+    # cProfile can only be active once per interpreter, concurrent profiled requests get timings only
+    _cprofile_lock = threading.Lock()
+
+    def __init__(self, top_n: int = 30):
+        """
+        Args:
+            top_n (int): Number of functions kept in the cProfile report, sorted by cumulative time.
+        """
+        self.profile_id = uuid.uuid4().hex
+        self.top_n = top_n
+        self.stages: List[Dict[str, Any]] = []
+        self._profile: Optional[cProfile.Profile] = None
+        self._profile_active = False
+        self._started: Optional[float] = None
+        self._total_seconds: Optional[float] = None
+
+    def start(self) -> None:
+        """
+        Starts the wall clock and, if no other request is being profiled, the cProfile profiler.
+        """
+        self._started = time.perf_counter()
+        if RequestProfiler._cprofile_lock.acquire(blocking=False):
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            self._profile_active = True
+
+    def stop(self) -> None:
+        """
+        Stops the profiler and releases the cProfile slot.
+        """
+        if self._started is not None and self._total_seconds is None:
+            self._total_seconds = time.perf_counter() - self._started
+        if self._profile and self._profile_active:
+            self._profile.disable()
+            self._profile_active = False
+            RequestProfiler._cprofile_lock.release()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Measures the wall-clock time of a pipeline stage.
+
+        Args:
+            name (str): The stage name as reported in the profile.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({"stage": name, "seconds": round(time.perf_counter() - started, 6)})
+
+    def server_timing(self) -> str:
+        """
+        Formats the stage timings as a Server-Timing header value.
+        """
+        return ", ".join(f"{stage['stage']};dur={stage['seconds'] * 1000:.2f}" for stage in self.stages)
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Builds the profile report with stage timings and the top cProfile entries.
+
+        Returns:
+            Dict[str, Any]: The profile report.
+        """
+        cprofile_report = None
+        if self._profile:
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=stream)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+            cprofile_report = stream.getvalue()
+
+        return {
+            "profile_id": self.profile_id,
+            "total_seconds": round(self._total_seconds, 6) if self._total_seconds is not None else None,
+            "stages": self.stages,
+            "cprofile": cprofile_report,
+        }
+
+
+class ProfileStore:
+    """
+    Keeps the most recent profile reports in memory, keyed by profile id.
+    """
+
+    def __init__(self):
+        self._reports: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, profiler: RequestProfiler) -> None:
+        with self._lock:
+            self._reports[profiler.profile_id] = profiler.report()
+            while len(self._reports) > settings.profile_store_size:
+                self._reports.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._reports.get(profile_id)
+
+    def list_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._reports.keys())
+
+
+NULL_PROFILER = NullProfiler()
+profile_store = ProfileStore()
+
+
+def get_request_profiler(profile_flag: Optional[str], token: Optional[str]):
+    """
+    Returns a RequestProfiler when profiling is enabled in the config and requested by the caller,
+    otherwise the shared no-op profiler.
+
+    Args:
+        profile_flag (Optional[str]): Value of the X-Profile header or the profile query parameter.
+        token (Optional[str]): Value of the X-Profile-Token header.
+    """
+    if not profile_flag or not settings.profiling_enabled:
+        return NULL_PROFILER
+    if profile_flag.lower() not in {"1", "true", "yes"}:
+        return NULL_PROFILER
+    if settings.profiling_token and token != settings.profiling_token:
+        return NULL_PROFILER
+    return RequestProfiler()
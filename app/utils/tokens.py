@@ -0,0 +1,49 @@
+from functools import lru_cache
+from typing import List, Optional
+
+from app.utils.logger import get_logger
+
+# Average characters per token of OpenAI tokenizers on English text, used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Optional[object]:
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Missing package, or the encoding file could not be downloaded
+        get_logger("Tokens").warning(f"tiktoken unavailable, token counts are estimated from the length: {e}")
+        return None
+
+
+def warm_up() -> None:
+    """
+    Loads the tokenizer, so the first request does not download or parse the encoding.
+    """
+    _encoding()
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of a text with tiktoken, or estimates them from the text length if
+    tiktoken cannot be loaded.
+
+    Args:
+        text (str): The text to count.
+
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def count_prompt_tokens(prompt: List[dict]) -> int:
+    """
+    Counts the tokens of the message contents of a chat prompt.
+    """
+    return sum(count_tokens(message["content"]) for message in prompt)
@@ -0,0 +1,292 @@
+"""
+Evaluates extraction configurations against a gold dataset and compares their accuracy and cost.
+
+Every sample runs through PromptGenerator, GPTService, CompletionParser and JSONValidator like a request
+of the service. Completions come from a recordings file, so the evaluation runs offline; record them
+once against the API with --record. With --mock gold, unrecorded requests are answered with the gold
+output, which measures prompt sizes and the pipeline itself.
+
+The dataset is a JSONL file of {"id", "text", "expected"} objects, or a directory of <name>.txt texts
+next to <name>.json gold outputs (such as gpt_completion.json). Configurations are a JSON list of
+{"name", "compact", "drop_nulls", "max_examples", "model"} objects.
+
+Usage:
+    python -m benchmarks.evaluation gold/ --examples examples.txt --schema response_format.json \
+        --validation-schema validation.json --configs configs.json --recordings recordings.jsonl --record
+    python -m benchmarks.evaluation gold/ --examples examples.txt --schema response_format.json \
+        --validation-schema validation.json --configs configs.json --recordings recordings.jsonl
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from benchmarks.recorded_completions import RecordedCompletions
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class Configuration:
+    """
+    One way of prompting the model that is compared against the others.
+    """
+    name: str
+    compact: bool = False
+    drop_nulls: bool = True
+    max_examples: Optional[int] = None
+    model: Optional[str] = None
+
+
+DEFAULT_CONFIGURATIONS = [Configuration("baseline"), Configuration("compact", compact=True)]
+
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    """
+    Loads the gold samples from a JSONL file or a directory of text and JSON pairs.
+
+    Returns:
+        List[Dict[str, Any]]: Samples with id, text and expected output.
+    """
+    if os.path.isdir(path):
+        samples = []
+        for name in sorted(os.listdir(path)):
+            stem, extension = os.path.splitext(name)
+            expected_path = os.path.join(path, stem + ".json")
+            if extension == ".txt" and os.path.exists(expected_path):
+                with open(os.path.join(path, name)) as text_file, open(expected_path) as expected_file:
+                    samples.append({"id": stem, "text": text_file.read(), "expected": json.load(expected_file)})
+        return samples
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def flatten(value: Any, path: str = "") -> Iterable[Tuple[str, Any]]:
+    """
+    Yields the non-null leaves of a JSON value as (field path, normalized value). Array items share
+    the path of their array, so they are compared regardless of their order.
+    """
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{path}.{key}" if path else key)
+    elif isinstance(value, list):
+        for item in value:
+            yield from flatten(item, f"{path}[]")
+    elif value is not None:
+        yield path, " ".join(value.split()).casefold() if isinstance(value, str) else value
+
+
+def field_counts(predicted: Any, expected: Any) -> Dict[str, Counter]:
+    """
+    Counts the true positives, predicted and expected leaves per field path.
+    """
+    predicted_leaves, expected_leaves = Counter(flatten(predicted)), Counter(flatten(expected))
+    matched = predicted_leaves & expected_leaves
+    counts: Dict[str, Counter] = {}
+    for name, leaves in (("tp", matched), ("predicted", predicted_leaves), ("expected", expected_leaves)):
+        for (path, _), count in leaves.items():
+            counts.setdefault(path, Counter())[name] += count
+    return counts
+
+
+def _ratio(numerator: float, denominator: float) -> float:
+    return round(numerator / denominator, 4) if denominator else 0.0
+
+
+def _select_examples(examples: str, max_examples: Optional[int]) -> str:
+    from app.core.config import settings
+
+    if max_examples is None:
+        return examples
+    separator = f"\n{settings.examples_separator}\n"
+    return separator.join(examples.split(separator)[:max_examples])
+
+
+def evaluate(configuration: Configuration, samples: List[Dict[str, Any]], examples: str,
+             response_format: Dict[str, Any], validation_schema: Dict[str, Any],
+             recordings: "RecordedCompletions") -> Dict[str, Any]:
+    """
+    Runs the pipeline over all samples with one configuration.
+
+    Args:
+        configuration (Configuration): The configuration to evaluate.
+        samples (List[Dict[str, Any]]): The gold samples.
+        examples (str): The examples as parsed by InputFileParser.
+        response_format (Dict[str, Any]): The response format sent to the model.
+        validation_schema (Dict[str, Any]): The schema the outputs are validated against.
+        recordings (RecordedCompletions): The recorded completions, for their latencies.
+
+    Returns:
+        Dict[str, Any]: The aggregated scores, token counts and latencies, with scores per field.
+    """
+    from app.core.config import settings
+    from app.services.completion_parser import CompletionParser
+    from app.services.gpt_service import GPTService
+    from app.services.input_file_parser import InputFileParser
+    from app.services.json_validator import JSONValidator
+    from app.services.prompt_compactor import PromptCompactor
+    from app.services.prompt_generator import PromptGenerator
+    from app.utils.hashing import profile_hash
+    from benchmarks.recorded_completions import request_key
+
+    examples = _select_examples(examples, configuration.max_examples)
+    if configuration.compact:
+        examples = PromptCompactor(configuration.drop_nulls).compact_examples(examples)
+    # The prompt prefix is cached per profile like in the service
+    profile = profile_hash(examples, response_format) if settings.prompt_prefix_cache else None
+    gpt_service = GPTService(api_key="")
+    if configuration.model:
+        gpt_service.DEFAULT_MODEL = configuration.model
+
+    fields: Dict[str, Counter] = {}
+    valid, failed = 0, 0
+    prompt_tokens, completion_tokens, completion_ms, pipeline_ms = [], [], [], []
+    for sample in samples:
+        started = time.perf_counter()
+        # Parsed like an upload, so the prompt matches the one the service sends
+        text = InputFileParser().parse_text(io.BytesIO(sample["text"].encode("utf-8")))
+        prompt_generator = PromptGenerator(text, examples, configuration.compact, profile)
+        prompt = prompt_generator.generate_prompt()
+        try:
+            completion = gpt_service.complete_prompt(prompt, response_format, retries=1,
+                                                     cache_key=prompt_generator.cache_key)
+        except KeyError as e:
+            print(f"{configuration.name}/{sample['id']}: {e.args[0]}", file=sys.stderr)
+            failed += 1
+            continue
+        parsed = CompletionParser(completion).parse_completion()
+        try:
+            valid += parsed is not None and JSONValidator(parsed, validation_schema).validate_structure()
+        except Exception:
+            pass
+        pipeline_ms.append((time.perf_counter() - started) * 1000)
+
+        usage = gpt_service.last_usage
+        prompt_tokens.append(usage.prompt_tokens)
+        completion_tokens.append(usage.completion_tokens)
+        recording = recordings.get(request_key(gpt_service.DEFAULT_MODEL, prompt, response_format))
+        completion_ms.append(recording["latency_ms"] if recording else 0.0)
+        for path, counts in field_counts(parsed, sample["expected"]).items():
+            fields.setdefault(path, Counter()).update(counts)
+
+    total = sum(fields.values(), Counter())
+    cost = (sum(prompt_tokens) * settings.llm_input_cost_per_million
+            + sum(completion_tokens) * settings.llm_output_cost_per_million) / 1_000_000
+    precision, recall = _ratio(total["tp"], total["predicted"]), _ratio(total["tp"], total["expected"])
+    evaluated = len(samples) - failed
+    return {
+        "configuration": configuration.name,
+        "samples": evaluated,
+        "missing_completions": failed,
+        "precision": precision,
+        "recall": recall,
+        "f1": _ratio(2 * precision * recall, precision + recall),
+        "validation_pass_rate": _ratio(valid, evaluated),
+        "prompt_tokens": round(statistics.mean(prompt_tokens), 1) if prompt_tokens else 0,
+        "cached_tokens": (round(gpt_service.usage_totals["cached_tokens"] / len(prompt_tokens), 1)
+                          if prompt_tokens else 0),
+        "completion_tokens": round(statistics.mean(completion_tokens), 1) if completion_tokens else 0,
+        "cost_per_sample": round(cost / len(prompt_tokens), 6) if prompt_tokens else 0,
+        "completion_ms_p50": round(statistics.median(completion_ms), 2) if completion_ms else 0,
+        "pipeline_ms_mean": round(statistics.mean(pipeline_ms), 2) if pipeline_ms else 0,
+        "fields": {path: {"precision": _ratio(counts["tp"], counts["predicted"]),
+                          "recall": _ratio(counts["tp"], counts["expected"])}
+                   for path, counts in sorted(fields.items())},
+    }
+
+
+COLUMNS = ["configuration", "samples", "precision", "recall", "f1", "validation_pass_rate", "prompt_tokens",
+           "cached_tokens", "completion_tokens", "cost_per_sample", "completion_ms_p50", "pipeline_ms_mean"]
+
+
+def format_table(results: List[Dict[str, Any]]) -> str:
+    """
+    Formats the results of all configurations as a Markdown comparison table.
+    """
+    rows = [COLUMNS] + [[str(result[column]) for column in COLUMNS] for result in results]
+    widths = [max(len(row[index]) for row in rows) for index in range(len(COLUMNS))]
+    lines = ["| " + " | ".join(cell.ljust(width) for cell, width in zip(row, widths)) + " |" for row in rows]
+    lines.insert(1, "|" + "|".join("-" * (width + 2) for width in widths) + "|")
+    return "\n".join(lines)
+
+
+def load_configurations(path: Optional[str]) -> List[Configuration]:
+    if not path:
+        return DEFAULT_CONFIGURATIONS
+    with open(path) as file:
+        return [Configuration(**configuration) for configuration in json.load(file)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", help="JSONL file or directory of text and gold JSON pairs")
+    parser.add_argument("--examples", required=True, help="Examples file (examples_file of the API)")
+    parser.add_argument("--schema", required=True, help="Response format file (json_file of the API)")
+    parser.add_argument("--validation-schema", required=True, help="Validation schema file")
+    parser.add_argument("--configs", help="JSON list of configurations, defaults to baseline and compact")
+    parser.add_argument("--recordings", help="JSONL file of recorded completions")
+    parser.add_argument("--record", action="store_true", help="Call the API and record the missing completions")
+    parser.add_argument("--mock", choices=["gold"], help="Answer unrecorded requests with the gold output")
+    parser.add_argument("--output", help="Write the full results, including scores per field, to this JSON file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not args.record:
+        os.environ.setdefault("LLM_API_KEY", "offline-evaluation")
+    sys.path.insert(0, PROJECT_ROOT)
+    from app.services.input_file_parser import InputFileParser
+    from app.services.json_validator import JSONValidator
+    from app.utils.tokens import count_tokens
+    from benchmarks.recorded_completions import (RecordedCompletions, ReplayClient, install_client,
+                                                 wrap_pool_clients)
+
+    samples = load_dataset(args.dataset)
+    configurations = load_configurations(args.configs)
+    file_parser = InputFileParser()
+    with open(args.examples, "rb") as file:
+        examples = file_parser.parse_examples(file)
+    with open(args.schema, "rb") as file:
+        response_format = file_parser.parse_json(file)
+    with open(args.validation_schema, "rb") as file:
+        validation_schema = file_parser.parse_validation_schema(file)
+
+    recordings = RecordedCompletions(os.path.abspath(args.recordings) if args.recordings else None)
+    if args.record:
+        wrap_pool_clients(recordings)
+    else:
+        gold = {InputFileParser().parse_text(io.BytesIO(sample["text"].encode("utf-8"))): sample["expected"]
+                for sample in samples}
+        fallback = (lambda messages: json.dumps(gold.get(messages[-1]["content"]))) if args.mock else None
+        install_client(ReplayClient(recordings, fallback))
+
+    # Loaded ahead, so the first configuration does not pay for them in its latency
+    import openai  # noqa: F401
+    JSONValidator.warm_up()
+    count_tokens("")
+    # CompletionParser writes gpt_completion.json to the working directory, keep it away from gold files
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            results = [evaluate(configuration, samples, examples, response_format, validation_schema, recordings)
+                       for configuration in configurations]
+        finally:
+            os.chdir(working_directory)
+
+    print(format_table(results))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
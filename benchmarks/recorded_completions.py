@@ -0,0 +1,151 @@
+"""
+Recorded OpenAI completions for offline runs. A recording maps the request (model, messages and
+response format) to the completion, its usage and its latency, so the pipeline can be replayed
+without network access or API cost.
+"""
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services.traffic_capture import CompletionStream, completion_object, usage_dict
+from app.utils.hashing import json_hash
+from app.utils.tokens import count_prompt_tokens, count_tokens
+
+
+def request_key(model: str, messages: List[dict], response_format: Any) -> str:
+    """
+    Identifies a completion request independently of the key and the sampling options.
+    """
+    return json_hash({"model": model, "messages": messages, "response_format": response_format})
+
+
+class RecordedCompletions:
+    """
+    JSONL file of recorded completions, one {"key", "completion", "usage", "latency_ms"} object per line.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(key)
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        """
+        Keeps a recorded completion and appends it to the file.
+        """
+        with self._lock:
+            self.entries[entry["key"]] = entry
+            if self.path:
+                with open(self.path, "a") as file:
+                    file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class ReplayClient:
+    """
+    Stands in for the OpenAI client and answers chat completions from recordings. Requests without a
+    recording are answered by the fallback, e.g. a mock returning the gold output, or fail.
+    """
+
+    def __init__(self, recordings: RecordedCompletions,
+                 fallback: Optional[Callable[[List[dict]], Optional[str]]] = None, simulate_latency: bool = False):
+        """
+        Args:
+            recordings (RecordedCompletions): The recorded completions.
+            fallback (Callable[[List[dict]], Optional[str]], optional): Returns a completion for unrecorded messages.
+            simulate_latency (bool): Sleep for the recorded latency before answering.
+        """
+        self.recordings = recordings
+        self.fallback = fallback
+        self.simulate_latency = simulate_latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def with_options(self, **_: Any) -> "ReplayClient":
+        return self
+
+    def create(self, model: str, messages: List[dict], response_format: Any = None, stream: bool = False,
+               **_: Any) -> Any:
+        entry = self.recordings.get(request_key(model, messages, response_format))
+        if entry is None and self.fallback is not None:
+            content = self.fallback(messages)
+            if content is not None:
+                entry = {"completion": content, "latency_ms": 0.0,
+                         "usage": {"prompt_tokens": count_prompt_tokens(messages),
+                                   "completion_tokens": count_tokens(content)}}
+        if entry is None:
+            raise KeyError("No recorded completion for the request, record it first")
+
+        if self.simulate_latency:
+            time.sleep(entry["latency_ms"] / 1000)
+        completion = completion_object(entry["completion"], entry["usage"])
+        return CompletionStream(completion) if stream else completion
+
+    def close(self) -> None:
+        pass
+
+
+class RecordingClient:
+    """
+    Wraps an OpenAI client and records every non-streamed chat completion it returns.
+    """
+
+    def __init__(self, client: Any, recordings: RecordedCompletions):
+        self.client = client
+        self.recordings = recordings
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def with_options(self, **options: Any) -> "RecordingClient":
+        return RecordingClient(self.client.with_options(**options), self.recordings)
+
+    def create(self, model: str, messages: List[dict], response_format: Any = None, **options: Any) -> Any:
+        if options.get("stream"):
+            raise ValueError("Streamed completions cannot be recorded, run without a cancellation token")
+        started = time.perf_counter()
+        completion = self.client.chat.completions.create(model=model, messages=messages,
+                                                         response_format=response_format, **options)
+        latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.recordings.add({
+            "key": request_key(model, messages, response_format),
+            "model": model,
+            "completion": completion.choices[0].message.content,
+            "usage": usage_dict(completion.usage),
+            "latency_ms": latency_ms,
+        })
+        return completion
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def install_client(client: Any) -> None:
+    """
+    Makes GPTService send every completion through the given client, using a single-key pool without budgets.
+    """
+    from app.services.api_key_pool import ApiKey, ApiKeyPool
+    from app.services.gpt_service import GPTService
+
+    key = ApiKey("offline", None, 10 ** 9, 10 ** 9)
+    key.client = client
+    GPTService._key_pool = ApiKeyPool([key], eviction_seconds=0, wait_timeout=0)
+
+
+def wrap_pool_clients(recordings: RecordedCompletions, api_key: str = "") -> None:
+    """
+    Records the completions of the configured key pool of GPTService.
+    """
+    from app.services.gpt_service import GPTService
+
+    GPTService.warm_up(api_key)
+    for key in GPTService._key_pool.keys:
+        key.client = RecordingClient(key.client, recordings)
@@ -0,0 +1,117 @@
+"""
+Measures the import time and the cold start of the service in fresh interpreter processes
+and fails when either exceeds its budget.
+
+Usage:
+    python -m benchmarks.startup_benchmark --runs 5 --max-import-ms 800 --max-cold-start-ms 1500
+    python -m benchmarks.startup_benchmark --save baseline.json
+    python -m benchmarks.startup_benchmark --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imports the app only, without running the startup hooks
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import app.main
+print((time.perf_counter() - started) * 1000)
+"""
+
+# Imports the app and runs the lifespan startup until the service reports ready
+COLD_START_SNIPPET = """
+import asyncio, time
+started = time.perf_counter()
+import app.main
+
+async def start():
+    async with app.main.lifespan(app.main.app):
+        assert app.main.app.state.ready, app.main.app.state.startup_error
+        print((time.perf_counter() - started) * 1000)
+
+asyncio.run(start())
+"""
+
+
+def _run_snippet(snippet: str) -> float:
+    """
+    Runs a snippet in a fresh interpreter and returns the milliseconds it printed.
+    """
+    env = dict(os.environ)
+    env.setdefault("LLM_API_KEY", "benchmark-key")
+    result = subprocess.run([sys.executable, "-c", snippet], cwd=PROJECT_ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure(runs: int) -> Dict[str, float]:
+    """
+    Measures the median import time and cold start over several fresh processes.
+
+    Args:
+        runs (int): Number of processes per measurement.
+
+    Returns:
+        Dict[str, float]: Median import_ms and cold_start_ms.
+    """
+    import_times: List[float] = [_run_snippet(IMPORT_SNIPPET) for _ in range(runs)]
+    cold_starts: List[float] = [_run_snippet(COLD_START_SNIPPET) for _ in range(runs)]
+    return {
+        "import_ms": round(statistics.median(import_times), 2),
+        "cold_start_ms": round(statistics.median(cold_starts), 2),
+    }
+
+
+def check_budgets(results: Dict[str, float], args: argparse.Namespace) -> List[str]:
+    """
+    Compares the results with the absolute budgets and the optional baseline.
+
+    Returns:
+        List[str]: One message per exceeded budget.
+    """
+    failures = []
+    limits = {"import_ms": args.max_import_ms, "cold_start_ms": args.max_cold_start_ms}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        for key in limits:
+            allowed = baseline[key] * (1 + args.tolerance)
+            limits[key] = min(limits[key], allowed) if limits[key] else allowed
+
+    for key, limit in limits.items():
+        if limit and results[key] > limit:
+            failures.append(f"{key} {results[key]}ms exceeds budget {round(limit, 2)}ms")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Absolute import time budget")
+    parser.add_argument("--max-cold-start-ms", type=float, default=None, help="Absolute cold start budget")
+    parser.add_argument("--baseline", help="JSON file with earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression over the baseline")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = measure(args.runs)
+    print(json.dumps(results, indent=4))
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=4)
+
+    failures = check_budgets(results, args)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
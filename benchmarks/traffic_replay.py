@@ -0,0 +1,425 @@
+"""
+Replays captured traffic against one or more builds of the service and compares their latency,
+throughput and memory.
+
+Each build is a checkout of the repository. It is started with uvicorn and OPENAI_BASE_URL pointing at
+a local mock of the OpenAI API, which answers from the capture after the captured completion latencies.
+The builds need no replay support, any checkout can be compared. The captured requests are sent at
+their original arrival offsets divided by --scale, with synthetic texts of the captured sizes. The
+first build is the baseline the others are compared against.
+
+Record a capture by running the service with CAPTURE_PATH=capture.jsonl. Masked captures (the default)
+record the examples and schemas as hashes only; pass the directory holding those files with --profiles.
+
+Usage:
+    git worktree add /tmp/baseline main
+    python -m benchmarks.traffic_replay capture.jsonl --profiles profiles/ --build /tmp/baseline --build . --scale 2
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Synthetic replay texts start with this marker, it tells the mock API which capture a prompt belongs to
+REPLAY_MARKER = "replay-request-{id}"
+_REPLAY_MARKER_PATTERN = re.compile(r"replay-request-(\d+)")
+PROFILE_FILES = ("examples", "json", "validation")
+
+# Words of the synthetic texts, varied so that replayed texts are not near-duplicates of each other
+_WORDS = ["flour", "sugar", "butter", "eggs", "milk", "salt", "bake", "stir", "minutes", "oven", "cup", "spoon",
+          "mix", "pour", "heat", "slice", "onion", "garlic", "pepper", "cream", "serve", "chill", "boil", "pan"]
+
+
+def synthetic_text(record_id: int, size: Optional[int]) -> bytes:
+    """
+    Builds a text of the captured size that carries the replay marker of the request.
+    """
+    generator = random.Random(record_id)
+    words = [REPLAY_MARKER.format(id=record_id)]
+    length = len(words[0])
+    while length < (size or 0):
+        word = generator.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words).encode("utf-8")[:max(size or 0, len(words[0]))]
+
+
+def attach_profile_files(profiles: Dict[str, Dict[str, Any]], directory: Optional[str]) -> None:
+    """
+    Fills in the files of masked profiles, which only carry hashes, from the files of a directory.
+    """
+    from app.utils.hashing import content_hash
+
+    if not directory:
+        return
+    by_hash = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            with open(os.path.join(root, name), "rb") as file:
+                data = file.read()
+            by_hash[content_hash(data)] = data.decode("utf-8", errors="replace")
+    for profile in profiles.values():
+        for name, recorded in profile.get("files", {}).items():
+            if name not in profile and recorded["sha256"] in by_hash:
+                profile[name] = by_hash[recorded["sha256"]]
+
+
+class CapturedCompletions:
+    """
+    The completions of a capture by request id and response schema. The synthetic text of a replayed
+    request carries the id of its capture.
+    """
+
+    def __init__(self, requests: List[Dict[str, Any]]):
+        self._completions: Dict[Tuple[int, Optional[str]], Deque[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        for record in requests:
+            for entry in record["completions"]:
+                self._completions.setdefault((record["id"], entry["schema"]), deque()).append(entry)
+                self._completions.setdefault((record["id"], None), deque()).append(entry)
+
+    def find(self, messages: List[dict], response_format: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Returns the captured completion of a prompt.
+
+        Raises:
+            KeyError: If the prompt carries no replay marker or the capture has no completion for it.
+        """
+        match = next(filter(None, (_REPLAY_MARKER_PATTERN.search(str(message.get("content")))
+                                   for message in reversed(messages))), None)
+        if not match:
+            raise KeyError("The prompt carries no replay marker")
+        record_id = int(match.group(1))
+        schema = ((response_format or {}).get("json_schema") or {}).get("name")
+        with self._lock:
+            entries = self._completions.get((record_id, schema)) or self._completions.get((record_id, None))
+            if not entries:
+                raise KeyError(f"No captured completion for request {record_id}")
+            # Rotate, so a request replayed more often than captured reuses its completions
+            entry = entries[0]
+            entries.rotate(-1)
+        return entry
+
+
+def _usage_json(usage: Dict[str, int]) -> Dict[str, Any]:
+    return {"prompt_tokens": usage["prompt_tokens"], "completion_tokens": usage["completion_tokens"],
+            "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+            "prompt_tokens_details": {"cached_tokens": usage.get("cached_tokens", 0)}}
+
+
+def _completion_body(entry: Dict[str, Any], model: str, stream: bool) -> Tuple[str, bytes]:
+    """
+    Builds the response of the chat completions API for a captured completion, as JSON or as an event stream.
+    """
+    base = {"id": "chatcmpl-replay", "created": int(time.time()), "model": model}
+    if not stream:
+        body = {**base, "object": "chat.completion", "usage": _usage_json(entry["usage"]),
+                "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                             "message": {"role": "assistant", "content": entry["completion"]}}]}
+        return "application/json", json.dumps(body).encode("utf-8")
+    chunks = [{**base, "object": "chat.completion.chunk", "usage": None,
+               "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                            "delta": {"role": "assistant", "content": entry["completion"]}}]},
+              {**base, "object": "chat.completion.chunk", "choices": [], "usage": _usage_json(entry["usage"])}]
+    events = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+    return "text/event-stream", events.encode("utf-8")
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """
+    Serves the chat completions API on localhost from a capture, after the captured latency of each completion.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, completions: CapturedCompletions, simulate_latency: bool = True):
+        self.completions = completions
+        self.simulate_latency = simulate_latency
+        super().__init__(("127.0.0.1", 0), _MockOpenAIHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def __enter__(self) -> "MockOpenAIServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockOpenAIServer
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, "application/json", b'{"error": {"message": "Not found"}}')
+            return
+        try:
+            entry = self.server.completions.find(request.get("messages", []), request.get("response_format"))
+        except KeyError as e:
+            self._send(404, "application/json", json.dumps({"error": {"message": str(e)}}).encode("utf-8"))
+            return
+        if self.server.simulate_latency:
+            time.sleep(entry["latency_ms"] / 1000)
+        self._send(200, *_completion_body(entry, request.get("model", ""), bool(request.get("stream"))))
+
+    def _send(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_: Any) -> None:
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    """
+    Returns the resident memory of a process in MB, read from /proc.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class MemorySampler(threading.Thread):
+    """
+    Samples the resident memory of the server process while the replay runs.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[float] = []
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            rss = _rss_mb(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+def start_server(build: str, openai_url: str, port: int, data_dir: str) -> subprocess.Popen:
+    """
+    Starts a build with OpenAI served by the mock API and waits until it reports ready. Builds without a
+    readiness probe are ready once they answer.
+    """
+    import httpx
+
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": openai_url,
+        "LLM_API_KEY": "replay",
+        "LLM_API_KEYS": "",
+        "LLM_API_KEYS_FILE": "",
+        "LOG_LEVEL": "WARNING",
+        "CAPTURE_PATH": "",
+        # Stores of the replayed build are kept out of its checkout
+        "RESULTS_DB_PATH": os.path.join(data_dir, "results.sqlite"),
+        "INCREMENTAL_STORE_DIR": os.path.join(data_dir, "incremental"),
+        "DEDUP_STORE_DIR": os.path.join(data_dir, "dedup"),
+        "EXPORT_DIR": "",
+    })
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                               "--log-level", "warning"], cwd=build, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server of {build} exited with {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health/ready", timeout=1).status_code in (200, 404):
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"Server of {build} did not become ready")
+
+
+def replay(build: str, capture_path: str, scale: float, limit: Optional[int], workers: int,
+           profiles_dir: Optional[str] = None, simulate_latency: bool = True) -> Dict[str, Any]:
+    """
+    Replays the capture against one build.
+
+    Args:
+        build (str): Directory of the build.
+        capture_path (str): The capture file.
+        scale (float): Speed-up of the arrival rate, 2 sends the requests twice as fast.
+        limit (int, optional): Replay only the first requests.
+        workers (int): Maximum concurrent requests of the client.
+        profiles_dir (str, optional): Directory with the examples and schemas of masked profiles.
+        simulate_latency (bool): Answer completions after their captured latency.
+
+    Returns:
+        Dict[str, Any]: Latency percentiles, throughput, status counts and memory of the build.
+    """
+    import httpx
+    from app.services.traffic_capture import load_capture
+
+    profiles, requests = load_capture(capture_path)
+    attach_profile_files(profiles, profiles_dir)
+    complete = {name for name, profile in profiles.items() if all(key in profile for key in PROFILE_FILES)}
+    if len(complete) < len(profiles):
+        print(f"{len(profiles) - len(complete)} profiles have no files, pass them with --profiles", file=sys.stderr)
+    # Requests answered without a completion (duplicates, rejections) cannot be rebuilt from the capture
+    replayable = [record for record in requests if record["completions"] and record.get("profile") in complete]
+    replayable = replayable[:limit] if limit else replayable
+    skipped = len(requests) - len(replayable)
+
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as data_dir, \
+            MockOpenAIServer(CapturedCompletions(requests), simulate_latency) as openai_mock:
+        server = start_server(build, openai_mock.url, port, data_dir)
+        sampler = MemorySampler(server.pid)
+        idle_rss = _rss_mb(server.pid)
+        sampler.start()
+        latencies: List[float] = []
+        send_delays: List[float] = []
+        statuses: Counter = Counter()
+        lock = threading.Lock()
+
+        def send(client: "httpx.Client", record: Dict[str, Any], scheduled: float) -> None:
+            profile = profiles[record["profile"]]
+            files = {"examples_file": ("examples.txt", profile["examples"].encode("utf-8"), "text/plain"),
+                     "text_file": ("text.txt", synthetic_text(record["id"], record["sizes"].get("text")),
+                                   "text/plain"),
+                     "json_file": ("schema.json", profile["json"].encode("utf-8"), "application/json"),
+                     "validation_schema_file": ("validation.json", profile["validation"].encode("utf-8"),
+                                                "application/json")}
+            # Synthetic texts cannot reproduce incremental updates or duplicates, every request is extracted
+            data = {"sharded": str(record["options"]["sharded"]).lower(), "duplicate_mode": "off"}
+            send_delay = time.monotonic() - scheduled
+            try:
+                status = client.post("/", files=files, data=data).status_code
+            except httpx.HTTPError:
+                status = "error"
+            with lock:
+                # Measured from the scheduled arrival, so time spent waiting for a free worker is not hidden
+                latencies.append((time.monotonic() - scheduled) * 1000)
+                send_delays.append(send_delay * 1000)
+                statuses[str(status)] += 1
+
+        first_offset = replayable[0]["offset"] if replayable else 0.0
+        limits = httpx.Limits(max_connections=workers, max_keepalive_connections=workers)
+        started = time.monotonic()
+        try:
+            with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=600, limits=limits) as client, \
+                    ThreadPoolExecutor(max_workers=workers) as executor:
+                # Each request is submitted at its arrival offset, at most `workers` are in flight
+                for record in replayable:
+                    scheduled = started + (record["offset"] - first_offset) / scale
+                    delay = scheduled - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    executor.submit(send, client, record, scheduled)
+            duration = time.monotonic() - started
+        finally:
+            sampler.stop()
+            server.terminate()
+            server.wait()
+
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "build": build,
+        "requests": len(latencies),
+        "skipped": skipped,
+        "statuses": dict(statuses),
+        "throughput_rps": round(len(latencies) / duration, 3) if duration else 0.0,
+        "latency_ms_mean": round(statistics.mean(latencies), 2) if latencies else 0.0,
+        "latency_ms_p50": round(quantiles[49], 2) if latencies else 0.0,
+        "latency_ms_p90": round(quantiles[89], 2) if latencies else 0.0,
+        "latency_ms_p99": round(quantiles[98], 2) if latencies else 0.0,
+        # Large values mean the client could not keep up with the schedule, raise --workers
+        "send_delay_ms_max": round(max(send_delays), 2) if send_delays else 0.0,
+        "rss_mb_idle": round(idle_rss, 1) if idle_rss else None,
+        "rss_mb_peak": round(max(sampler.samples), 1) if sampler.samples else None,
+    }
+
+
+COLUMNS = ["throughput_rps", "latency_ms_mean", "latency_ms_p50", "latency_ms_p90", "latency_ms_p99",
+           "send_delay_ms_max", "rss_mb_idle", "rss_mb_peak"]
+
+
+def format_report(results: List[Dict[str, Any]]) -> str:
+    """
+    Formats the results as a Markdown table, with the change of every build relative to the first one.
+    """
+    baseline = results[0]
+    header = ["metric"] + [result["build"] for result in results]
+    rows = [header, ["requests"] + [str(result["requests"]) for result in results],
+            ["statuses"] + [json.dumps(result["statuses"], sort_keys=True) for result in results]]
+    for column in COLUMNS:
+        row = [column]
+        for result in results:
+            value, base = result[column], baseline[column]
+            cell = str(value)
+            if result is not baseline and value is not None and base:
+                cell += f" ({(value - base) / base:+.1%})"
+            row.append(cell)
+        rows.append(row)
+    widths = [max(len(row[index]) for row in rows) for index in range(len(header))]
+    lines = ["| " + " | ".join(cell.ljust(width) for cell, width in zip(row, widths)) + " |" for row in rows]
+    lines.insert(1, "|" + "|".join("-" * (width + 2) for width in widths) + "|")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="Capture file recorded with CAPTURE_PATH")
+    parser.add_argument("--build", action="append", required=True,
+                        help="Checkout of a build to replay against, repeat to compare builds")
+    parser.add_argument("--profiles", help="Directory with the examples and schema files of masked profiles")
+    parser.add_argument("--no-latency", action="store_true", help="Answer completions without the captured latency")
+    parser.add_argument("--scale", type=float, default=1.0, help="Speed-up of the captured arrival rate")
+    parser.add_argument("--limit", type=int, help="Replay only the first requests")
+    parser.add_argument("--workers", type=int, default=64, help="Maximum concurrent requests of the client")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, PROJECT_ROOT)
+    results = [replay(os.path.abspath(build), args.capture, args.scale, args.limit, args.workers, args.profiles,
+                      not args.no_latency) for build in args.build]
+    print(format_report(results))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
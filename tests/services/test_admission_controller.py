@@ -0,0 +1,264 @@
+import asyncio
+import selectors
+
+import pytest
+
+from app.services.admission_controller import AdmissionController, AdmissionRejected
+
+
+class VirtualSelector(selectors.DefaultSelector):
+    """
+    Selector that never blocks: a wait for the next timer advances the virtual clock instead.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events and timeout:
+            self.now += timeout
+        return events
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop on a virtual clock, so queue timeouts elapse instantly and deterministically.
+    """
+
+    def __init__(self):
+        self.selector = VirtualSelector()
+        super().__init__(self.selector)
+
+    def time(self) -> float:
+        return self.selector.now
+
+
+def run(coroutine):
+    loop = VirtualTimeLoop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def controller(**kwargs) -> AdmissionController:
+    options = {"max_in_flight": 1, "max_queue": 10, "queue_timeout": 30.0}
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+async def hold(admission: AdmissionController, release: asyncio.Event, order: list, name: str,
+               expected_seconds: float = 0.0, client_id=None, timeout=None) -> None:
+    async with admission.admit(client_id, timeout, expected_seconds):
+        order.append(name)
+        await release.wait()
+
+
+async def settle() -> None:
+    """
+    Lets the tasks started so far run until they block.
+    """
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_up_to_max_in_flight_and_queues_the_rest():
+    async def scenario():
+        admission = controller(max_in_flight=2)
+        release, order = asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(admission, release, order, name)) for name in "abc"]
+        await settle()
+        assert order == ["a", "b"]
+        assert (admission.in_flight, admission.waiting) == (2, 1)
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "c"]
+        assert (admission.in_flight, admission.waiting, admission._free_slots) == (0, 0, 2)
+
+    run(scenario())
+
+
+def test_released_slot_is_handed_over_before_new_arrivals():
+    async def scenario():
+        admission = controller()
+        first, rest, order = asyncio.Event(), asyncio.Event(), []
+        running = asyncio.create_task(hold(admission, first, order, "running"))
+        await settle()
+        queued = asyncio.create_task(hold(admission, rest, order, "queued"))
+        await settle()
+
+        first.set()
+        await running
+        # The slot went to the queued request, a request arriving now must queue behind it
+        late = asyncio.create_task(hold(admission, rest, order, "late"))
+        await settle()
+        assert order == ["running", "queued"]
+        assert admission.waiting == 1
+
+        rest.set()
+        await asyncio.gather(queued, late)
+        assert order == ["running", "queued", "late"]
+        assert admission._free_slots == 1
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("scheduling, expected", [("fifo", ["running", "big", "small", "mid"]),
+                                                  ("sjf", ["running", "small", "mid", "big"])])
+def test_queue_order_follows_scheduling(scheduling, expected):
+    async def scenario():
+        admission = controller(scheduling=scheduling)
+        release, order = asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(admission, release, order, "running"))]
+        await settle()
+        for name, seconds in (("big", 30.0), ("small", 1.0), ("mid", 5.0)):
+            tasks.append(asyncio.create_task(hold(admission, release, order, name, expected_seconds=seconds)))
+            await settle()
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert order == expected
+
+    run(scenario())
+
+
+def test_queue_timeout_rejects_and_frees_the_queue_entry():
+    async def scenario():
+        admission = controller(queue_timeout=5.0)
+        release, order = asyncio.Event(), []
+        running = asyncio.create_task(hold(admission, release, order, "running"))
+        await settle()
+
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await hold(admission, release, order, "queued")
+        assert rejected.value.status_code == 503
+        assert rejected.value.reason == "queue_timeout"
+        assert asyncio.get_running_loop().time() - started == pytest.approx(5.0)
+        assert admission.waiting == 0
+        assert admission._waiters == []
+
+        release.set()
+        await running
+        assert admission._free_slots == 1
+
+    run(scenario())
+
+
+def test_shorter_timeout_of_the_request_wins():
+    async def scenario():
+        admission = controller(queue_timeout=30.0)
+        release, order = asyncio.Event(), []
+        running = asyncio.create_task(hold(admission, release, order, "running"))
+        await settle()
+
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(AdmissionRejected):
+            await hold(admission, release, order, "queued", timeout=2.0)
+        assert asyncio.get_running_loop().time() - started == pytest.approx(2.0)
+
+        release.set()
+        await running
+
+    run(scenario())
+
+
+def test_cancelled_waiter_does_not_leak_its_slot():
+    async def scenario():
+        admission = controller()
+        release, order = asyncio.Event(), []
+        running = asyncio.create_task(hold(admission, release, order, "running"))
+        await settle()
+        queued = asyncio.create_task(hold(admission, release, order, "queued"))
+        await settle()
+
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert (admission.waiting, admission._waiters) == (0, [])
+
+        release.set()
+        await running
+        assert admission._free_slots == 1
+        assert order == ["running"]
+
+    run(scenario())
+
+
+def test_slot_handed_over_as_the_wait_is_cancelled_is_passed_on():
+    async def scenario():
+        admission = controller()
+        release, order, waiters = asyncio.Event(), [], {}
+
+        async def hand_over_then_cancel():
+            async with admission.admit():
+                order.append("running")
+                await release.wait()
+            # Same loop step as the handover: the first waiter holds the slot but has not resumed yet
+            waiters["cancelled"].cancel()
+
+        running = asyncio.create_task(hand_over_then_cancel())
+        await settle()
+        waiters["cancelled"] = asyncio.create_task(hold(admission, release, order, "cancelled"))
+        await settle()
+        next_in_line = asyncio.create_task(hold(admission, release, order, "next"))
+        await settle()
+
+        release.set()
+        await asyncio.gather(running, waiters["cancelled"], next_in_line, return_exceptions=True)
+
+        # Before Python 3.12 wait_for returns the handed-over slot despite the cancellation, so the waiter
+        # either runs or passes the slot on; either way the next request gets in and no slot is lost
+        assert order in (["running", "next"], ["running", "cancelled", "next"])
+        assert (admission.in_flight, admission.waiting, admission._free_slots) == (0, 0, 1)
+
+    run(scenario())
+
+
+def test_full_queue_is_shed_immediately():
+    async def scenario():
+        admission = controller(max_queue=1)
+        release, order = asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(admission, release, order, name)) for name in ("running", "queued")]
+        await settle()
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await hold(admission, release, order, "shed")
+        assert (rejected.value.status_code, rejected.value.reason) == (503, "queue_full")
+        assert rejected.value.retry_after >= 1
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+    run(scenario())
+
+
+def test_client_quota_counts_running_and_queued_requests():
+    async def scenario():
+        admission = controller(client_max_in_flight=2)
+        release, order = asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(admission, release, order, name, client_id="client"))
+                 for name in ("running", "queued")]
+        await settle()
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await hold(admission, release, order, "over", client_id="client")
+        assert (rejected.value.status_code, rejected.value.reason) == (429, "client_quota")
+        # Other clients are not affected by the quota
+        other = asyncio.create_task(hold(admission, release, order, "other", client_id="other"))
+        await settle()
+        assert admission.waiting == 2
+
+        release.set()
+        await asyncio.gather(*tasks, other)
+        assert admission._client_requests == {}
+
+    run(scenario())
+
+
+def test_rejects_unknown_scheduling():
+    with pytest.raises(ValueError):
+        controller(scheduling="lifo")
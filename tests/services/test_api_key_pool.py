@@ -0,0 +1,287 @@
+import time
+
+import pytest
+
+from app.services import api_key_pool
+from app.services.api_key_pool import ApiKey, ApiKeyPool, NoKeyAvailable, TokenBucket, parse_key_entries
+from app.utils.cancellation import CancellationToken, RequestCancelled
+
+
+class FakeClock:
+    """
+    Monotonic clock that only moves when slept on or advanced.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeClient:
+    closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def make_key(clock: FakeClock, name: str, requests_per_minute: int = 0, tokens_per_minute: int = 0) -> ApiKey:
+    key = ApiKey(f"sk-test-{name}", None, requests_per_minute, tokens_per_minute, clock)
+    # A stand-in client keeps the pool from creating OpenAI clients
+    key.client = FakeClient()
+    return key
+
+
+def make_pool(clock: FakeClock, keys, eviction_seconds: float = 60.0, wait_timeout: float = 30.0) -> ApiKeyPool:
+    return ApiKeyPool(keys, eviction_seconds, wait_timeout, clock, clock.sleep)
+
+
+def test_bucket_refills_continuously_up_to_capacity(clock):
+    bucket = TokenBucket(600, clock)
+    bucket.consume(600)
+    assert bucket.available() == 0
+    assert bucket.seconds_until(100) == pytest.approx(10.0)
+
+    clock.now += 5
+    assert bucket.available() == pytest.approx(50)
+    clock.now += 3600
+    assert bucket.available() == 600
+    assert bucket.used() == 0
+
+
+def test_bucket_can_go_negative_and_refunds_are_capped(clock):
+    bucket = TokenBucket(600, clock)
+    bucket.consume(700)
+    assert bucket.available() == -100
+    assert bucket.seconds_until(600) == pytest.approx(70.0)
+    bucket.consume(-2000)
+    assert bucket.available() == 600
+
+
+def test_bucket_without_budget_never_runs_empty(clock):
+    bucket = TokenBucket(0, clock)
+    bucket.consume(10 ** 9)
+    assert bucket.available() == float("inf")
+    assert bucket.seconds_until(10 ** 9) == 0
+    assert bucket.used() == 0
+
+
+def test_acquire_prefers_the_least_loaded_key(clock):
+    first, second = make_key(clock, "first", tokens_per_minute=10000), make_key(clock, "second",
+                                                                                 tokens_per_minute=10000)
+    pool = make_pool(clock, [first, second])
+
+    assert pool.acquire(4000) is first
+    assert pool.acquire(1000) is second
+    # first has 60% of its budget in use, second 10%
+    assert pool.acquire(1000) is second
+    assert (first.in_flight, second.in_flight) == (1, 2)
+
+
+def test_keys_without_budget_are_balanced_by_in_flight_requests(clock):
+    keys = [make_key(clock, "first"), make_key(clock, "second")]
+    pool = make_pool(clock, keys)
+
+    leased = [pool.acquire(10 ** 6) for _ in range(4)]
+    assert [key.in_flight for key in keys] == [2, 2]
+    assert set(leased) == set(keys)
+    assert clock.slept == []
+
+
+def test_release_corrects_the_budget_with_the_actual_usage(clock):
+    key = make_key(clock, "key", tokens_per_minute=10000)
+    pool = make_pool(clock, [key])
+
+    pool.acquire(3000)
+    pool.release(key, 3000, 1000)
+    assert key.tokens.available() == 9000
+    assert (key.in_flight, key.total_requests, key.total_tokens) == (0, 1, 1000)
+
+    # A failed request returns its whole estimate
+    pool.acquire(3000)
+    pool.release(key, 3000, None)
+    assert key.tokens.available() == 9000
+
+
+def test_acquire_waits_for_the_budget_to_refill(clock):
+    key = make_key(clock, "key", tokens_per_minute=600)
+    pool = make_pool(clock, [key])
+    pool.acquire(600)
+
+    started = clock.now
+    assert pool.acquire(100) is key
+    assert clock.now - started == pytest.approx(10.0)
+    assert all(seconds <= 1.0 for seconds in clock.slept)
+
+
+def test_acquire_waits_for_the_request_budget(clock):
+    key = make_key(clock, "key", requests_per_minute=60)
+    pool = make_pool(clock, [key])
+    for _ in range(60):
+        pool.acquire(1)
+
+    started = clock.now
+    pool.acquire(1)
+    assert clock.now - started == pytest.approx(1.0)
+
+
+def test_request_larger_than_the_budget_runs_on_a_full_bucket(clock):
+    key = make_key(clock, "key", tokens_per_minute=1000)
+    pool = make_pool(clock, [key])
+
+    assert pool.acquire(5000) is key
+    assert clock.slept == []
+
+
+def test_acquire_gives_up_after_the_wait_timeout(clock):
+    key = make_key(clock, "key", tokens_per_minute=600)
+    pool = make_pool(clock, [key], wait_timeout=5.0)
+    pool.acquire(600)
+
+    started = clock.now
+    with pytest.raises(NoKeyAvailable):
+        pool.acquire(100)
+    # The wait is known to exceed the timeout, so it fails without sleeping it out
+    assert clock.now - started <= 5.0
+
+
+def test_cancelled_request_stops_waiting(clock):
+    key = make_key(clock, "key", tokens_per_minute=600)
+    cancellation = CancellationToken()
+
+    def sleep(seconds: float) -> None:
+        clock.sleep(seconds)
+        cancellation.cancel("client_disconnected")
+
+    pool = ApiKeyPool([key], 60.0, 30.0, clock, sleep)
+    pool.acquire(600)
+    with pytest.raises(RequestCancelled):
+        pool.acquire(100, cancellation)
+    assert len(clock.slept) == 1
+
+
+def test_wait_does_not_outlast_the_deadline(clock):
+    key = make_key(clock, "key", tokens_per_minute=600)
+
+    def sleep(seconds: float) -> None:
+        clock.sleep(seconds)
+        time.sleep(seconds)
+
+    pool = ApiKeyPool([key], 60.0, 30.0, clock, sleep)
+    pool.acquire(600)
+    cancellation = CancellationToken(time.monotonic() + 0.2)
+    with pytest.raises(RequestCancelled) as cancelled:
+        pool.acquire(100, cancellation)
+    assert cancelled.value.reason == "deadline_exceeded"
+    # A 10s wait for the budget, cut short at the deadline
+    assert clock.slept[0] <= 0.2
+
+
+def test_evicted_key_is_skipped_until_the_eviction_ends(clock):
+    first, second = make_key(clock, "first"), make_key(clock, "second")
+    pool = make_pool(clock, [first, second], eviction_seconds=60.0)
+
+    pool.evict(first, RuntimeError("invalid key"))
+    assert [pool.acquire(1) for _ in range(3)] == [second, second, second]
+    assert first.errors == 1
+    assert pool.utilization()[first.name]["evicted_seconds"] == 60.0
+
+    clock.now += 60
+    assert pool.acquire(1) is first
+
+
+def test_all_keys_evicted(clock):
+    key = make_key(clock, "key")
+    pool = make_pool(clock, [key], eviction_seconds=60.0, wait_timeout=5.0)
+
+    pool.evict(key, RuntimeError("insufficient_quota"))
+    assert not pool.has_available_key()
+    with pytest.raises(NoKeyAvailable):
+        pool.acquire(1)
+
+    # A short eviction, like a plain rate limit, is waited out
+    pool.evict(key, RuntimeError("rate limited"), seconds=2.0)
+    started = clock.now
+    assert pool.acquire(1) is key
+    assert clock.now - started == pytest.approx(2.0)
+    assert pool.has_available_key()
+
+
+def test_utilization_reports_budget_usage_per_key(clock):
+    key = make_key(clock, "key", requests_per_minute=100, tokens_per_minute=10000)
+    pool = make_pool(clock, [key])
+    pool.acquire(2500)
+
+    utilization = pool.utilization()[key.name]
+    assert utilization["in_flight"] == 1
+    assert utilization["request_budget_used"] == pytest.approx(0.01)
+    assert utilization["token_budget_used"] == pytest.approx(0.25)
+
+
+def test_pool_requires_a_key():
+    with pytest.raises(ValueError):
+        ApiKeyPool([], 60.0, 30.0)
+
+
+def test_parse_key_entries():
+    assert parse_key_entries(" sk-a , sk-b:org-b,,", "fallback") == [("sk-a", None), ("sk-b", "org-b")]
+    assert parse_key_entries("", "fallback") == [("fallback", None)]
+    assert parse_key_entries("", "") == []
+
+
+def test_reload_keeps_the_statistics_of_remaining_keys(clock):
+    kept, removed = make_key(clock, "kept", tokens_per_minute=10000), make_key(clock, "removed")
+    pool = make_pool(clock, [kept, removed])
+    pool.acquire(4000)
+    leased = pool.acquire(1)
+    assert leased is removed
+
+    pool.reload([make_key(clock, "kept", tokens_per_minute=10000), make_key(clock, "added")])
+    assert pool.keys[0] is kept
+    assert kept.tokens.available() == 6000
+    assert [key.name for key in pool.keys] == [kept.name, "...dded"]
+    # A request still running on a removed key is released normally, then its client is closed
+    assert not removed.client.closed
+    pool.release(removed, 1, 1)
+    assert removed.total_requests == 1 and removed.client.closed
+    assert removed.name not in pool.utilization()
+
+
+def test_keys_file_is_reloaded_when_it_changes(clock, tmp_path):
+    keys_file = tmp_path / "keys"
+    keys_file.write_text("sk-test-first\n")
+    def create_key(api_key, organization):
+        key = ApiKey(api_key, organization, 0, 0, clock)
+        key.client = FakeClient()
+        return key
+
+    first = make_key(clock, "first")
+    pool = ApiKeyPool([first], 60.0, 30.0, clock, clock.sleep, str(keys_file), create_key)
+    keys_file.write_text("sk-test-first\nsk-test-second:org\n")
+    pool.acquire(1)
+    # Not checked again before KEYS_FILE_CHECK_SECONDS
+    assert len(pool.keys) == 1
+
+    clock.now += api_key_pool.KEYS_FILE_CHECK_SECONDS
+    pool.acquire(1)
+    assert [(key.api_key, key.organization) for key in pool.keys] == [("sk-test-first", None),
+                                                                       ("sk-test-second", "org")]
+    # The lease taken before the reload is kept on the same key object
+    assert pool.keys[0] is first and first.in_flight == 1
+
+    # An emptied file keeps the current keys
+    keys_file.write_text("\n")
+    clock.now += api_key_pool.KEYS_FILE_CHECK_SECONDS
+    pool.acquire(1)
+    assert len(pool.keys) == 2
@@ -0,0 +1,62 @@
+import random
+
+from app.services.incremental_extractor import IncrementalExtractor, SectionStore
+
+SCHEMA = {"type": "object", "properties": {"items": {"type": "array", "items": {"type": "string"}}}}
+
+
+def paragraphs(count: int, seed: int = 1):
+    generator = random.Random(seed)
+    words = ["flour", "sugar", "butter", "eggs", "milk", "salt", "bake", "stir", "oven", "pan"]
+    return [" ".join(generator.choice(words) for _ in range(generator.randint(5, 40))) for _ in range(count)]
+
+
+def make_extractor(tmp_path, calls=None) -> IncrementalExtractor:
+    def extract_section(section: str):
+        if calls is not None:
+            calls.append(section)
+        return {"items": [section[:10]]}
+
+    return IncrementalExtractor(extract_section, SCHEMA, "profile", SectionStore(str(tmp_path)))
+
+
+def test_edit_keeps_the_boundaries_of_later_sections(tmp_path):
+    extractor = make_extractor(tmp_path)
+    original = paragraphs(200)
+    edited = list(original)
+    edited[3] += " plus one more pinch of salt"
+
+    before = extractor.split_sections("\n\n".join(original))
+    after = extractor.split_sections("\n\n".join(edited))
+    assert 1 < len(before) < len(original)
+    changed = [section for section in after if section not in before]
+    # The edited section and at most the one after it, when the edit moves a boundary
+    assert 1 <= len(changed) <= 2
+    assert after[-len(before) + 2:] == before[-len(before) + 2:]
+
+
+def test_long_paragraphs_always_stand_alone(tmp_path):
+    extractor = make_extractor(tmp_path)
+    text = "\n\n".join("x" * 500 + str(index) for index in range(5))
+    assert len(extractor.split_sections(text)) == 5
+
+
+def test_results_are_stored_only_once_saved(tmp_path):
+    calls = []
+    text = "\n\n".join(paragraphs(50))
+
+    extractor = make_extractor(tmp_path, calls)
+    extractor.extract("doc", text)
+    extracted = len(calls)
+    # Nothing is reused from an extraction that was never saved, e.g. because validation failed
+    extractor = make_extractor(tmp_path, calls)
+    extractor.extract("doc", text)
+    assert len(calls) == 2 * extracted
+    assert extractor.store.load("doc") is None
+
+    extractor.save()
+    extractor = make_extractor(tmp_path, calls)
+    merged = extractor.extract("doc", text)
+    assert len(calls) == 2 * extracted
+    assert extractor.reused_sections == extracted
+    assert len(merged["items"]) == len(extractor.split_sections(text))
@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from app.services.schema_sharder import extract_sharded
+from app.utils.cancellation import CancellationToken, RequestCancelled
+
+RESPONSE_FORMAT = {"type": "json_schema", "json_schema": {"name": "Recipe", "schema": {
+    "type": "object",
+    "properties": {"title": {"type": "string"}, "servings": {"type": "integer"},
+                   "ingredients": {"type": "array", "items": {"type": "string"}}},
+    "required": ["title", "servings", "ingredients"]}}}
+
+
+def shard_keys(response_format):
+    return list(response_format["json_schema"]["schema"]["properties"])
+
+
+def test_shards_are_merged_in_schema_order():
+    def extract(response_format, cancellation):
+        return {key: key.upper() for key in shard_keys(response_format)}
+
+    result = extract_sharded(extract, RESPONSE_FORMAT, 3, CancellationToken())
+    assert list(result) == ["title", "servings", "ingredients"]
+
+
+def test_format_without_json_schema_is_extracted_once():
+    calls = []
+
+    def extract(response_format, cancellation):
+        calls.append(response_format)
+        return {"title": "Pancakes"}
+
+    assert extract_sharded(extract, {"type": "json_object"}, 3, CancellationToken()) == {"title": "Pancakes"}
+    assert calls == [{"type": "json_object"}]
+
+
+def test_failed_shard_cancels_the_others_but_not_the_request():
+    request = CancellationToken()
+    aborted = threading.Event()
+
+    def extract(response_format, cancellation):
+        if "ingredients" in shard_keys(response_format):
+            raise ValueError("invalid completion")
+        # Stands in for an LLM call that is aborted through the token
+        cancellation.add_callback(aborted.set)
+        assert aborted.wait(5)
+        cancellation.raise_if_cancelled()
+
+    with pytest.raises(ValueError):
+        extract_sharded(extract, RESPONSE_FORMAT, 3, request)
+    assert aborted.is_set()
+    assert not request.cancelled
+
+
+def test_request_cancellation_reaches_the_shards():
+    request = CancellationToken()
+    started = threading.Barrier(3)
+
+    def extract(response_format, cancellation):
+        aborted = threading.Event()
+        cancellation.add_callback(aborted.set)
+        started.wait(5)
+        if "ingredients" in shard_keys(response_format):
+            request.cancel("client_disconnected")
+        assert aborted.wait(5)
+        cancellation.raise_if_cancelled()
+
+    with pytest.raises(RequestCancelled) as cancelled:
+        extract_sharded(extract, RESPONSE_FORMAT, 3, request)
+    assert cancelled.value.reason == "client_disconnected"